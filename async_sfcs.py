@@ -0,0 +1,153 @@
+'''The async SFCS module defines an asyncio runtime for the SFCS.
+Bidding managers, agents and tasks run as coroutines on a single event loop instead of pinning an OS thread each, which allows simulating fleets of thousands of resource agents in one process.
+The classes are constructed like their counterparts in the sfcs module. Scheduling tasks has to be awaited and agents have to be started from within a running event loop.'''
+
+import asyncio
+import itertools
+
+import event_log
+import instrumentation
+import sfcs
+
+
+class BiddingManager(sfcs.BiddingManager):
+    '''Bidding Manager class representing a BM as described by MANPro, running on an asyncio event loop.'''
+
+    def __init__(self, resource_storage, bid_strategy=None):
+        sfcs.BiddingManager.__init__(self, resource_storage, bid_strategy=bid_strategy)
+        self.availability_waiters = []
+
+
+    def set_manufacturing_resource_availability(self, index, value):
+        sfcs.BiddingManager.set_manufacturing_resource_availability(self, index, value)
+        if value:
+            for waiter in self.availability_waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.availability_waiters.clear()
+
+
+    async def schedule_task(self, task, timeout=None):
+        '''Coroutine counterpart of sfcs.BiddingManager.schedule_task().'''
+        return await self.schedule_tasks([task], timeout) == 1
+
+
+    async def schedule_tasks(self, tasks, timeout=None):
+        '''Coroutine counterpart of sfcs.BiddingManager.schedule_tasks().'''
+        num_scheduled_tasks = 0
+        for task_name, task_group in itertools.groupby(tasks, key=lambda task: task.name):
+            candidate_manufacturing_resources = await self.acquire_manufacturing_resources_async(task_name, timeout)
+            if candidate_manufacturing_resources is None:
+                break
+            task_group = list(task_group)
+            t_agent = TaskAgent(self, task_group, candidate_manufacturing_resources)
+            await t_agent.run()
+            num_scheduled_tasks += len(task_group)
+        return num_scheduled_tasks
+
+
+    async def acquire_manufacturing_resources_async(self, task_name, timeout=None):
+        '''Coroutine counterpart of acquire_manufacturing_resources(). Waiting for a compatible resource agent to be released suspends the coroutine.'''
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            candidate_manufacturing_resources = self.acquire_manufacturing_resources(task_name, 0.0)
+            if candidate_manufacturing_resources is not None:
+                return candidate_manufacturing_resources
+            waiter = loop.create_future()
+            self.availability_waiters.append(waiter)
+            remaining_time = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(waiter, remaining_time)
+            except asyncio.TimeoutError:
+                return None
+
+
+class ResourceAgent(sfcs.ResourceAgent):
+    '''Resource agent class representing a R-Agent as described by MANPro, running as a coroutine.
+    Compatible tasks is a list of names of tasks this agent is able to perform and the task schedule type determines the order scheduled tasks are performed in.'''
+    def __init__(self, compatible_tasks, task_schedule_type=sfcs.TaskSchedule):
+        sfcs.ResourceAgent.__init__(self, compatible_tasks, task_schedule_type=task_schedule_type)
+        self.task_added = asyncio.Event()
+        self.update_loop_task = None
+
+
+    async def run_update_loop(self):
+        '''Update loop used internally to run an resource agent's logic as a coroutine.'''
+        while self.run_loop:
+            task = self.task_schedule.get(block=False)
+            if task:
+                self.set_current_task(task)
+                if event_log.active:
+                    event_log.active.task_started(task, self)
+                active_instrumentation = instrumentation.active
+                if active_instrumentation:
+                    start_time = active_instrumentation.now()
+                    await self.perform_task(task)
+                    active_instrumentation.task_performed(self, task, start_time, active_instrumentation.now())
+                else:
+                    await self.perform_task(task)
+                if event_log.active:
+                    event_log.active.task_finished(task, self)
+                self.set_current_task(None)
+            else:
+                self.task_added.clear()
+                await self.task_added.wait()
+
+
+    async def perform_task(self, task):
+        '''Performs a task until completion.'''
+        await task.execute_async()
+
+
+    def run(self):
+        '''Starts the resource agent on the running event loop. After executing this method the agent is able to perform tasks.'''
+        self.update_loop_task = asyncio.get_running_loop().create_task(self.run_update_loop())
+
+
+    def stop(self):
+        '''Stops a resource agent. A task waiting for resources is cancelled.'''
+        sfcs.ResourceAgent.stop(self)
+        if self.update_loop_task:
+            self.update_loop_task.cancel()
+
+
+    def add_task_to_schedule(self, task):
+        '''Adds a task to the agent's task schedule and wakes the agent up if it is idle.'''
+        self.task_schedule.put(task)
+        self.task_added.set()
+
+
+class RecursiveResourceAgent(ResourceAgent):
+    '''Recursive resource agent class representing a R-Agent as described by MANPro, running as a coroutine.
+    The bidding manager has to be a bidding manager of this module. Tasks are delegated and bids are placed like by sfcs.RecursiveResourceAgent.'''
+    def __init__(self, bidding_manager, compatible_tasks, max_delegated_tasks=None, task_schedule_type=sfcs.TaskSchedule):
+        ResourceAgent.__init__(self, compatible_tasks, task_schedule_type)
+        self.bidding_manager = bidding_manager
+        self.max_delegated_tasks = max_delegated_tasks
+
+    dynamic_load = sfcs.RecursiveResourceAgent.dynamic_load
+    take_delegated_tasks = sfcs.RecursiveResourceAgent.take_delegated_tasks
+    queue_length = sfcs.RecursiveResourceAgent.queue_length
+    estimated_completion_time = sfcs.RecursiveResourceAgent.estimated_completion_time
+
+
+    async def perform_task(self, task):
+        await self.bidding_manager.schedule_tasks(self.take_delegated_tasks(task))
+
+
+class TaskAgent(sfcs.TaskAgent):
+    '''Task Agent class representing a T-Agent as described by MANPro, running as a coroutine.
+    Bids are computed by the negotiation agent of the sfcs module, as generating them never has to wait.'''
+
+    async def run(self):
+        '''Negotiates the tasks one after another. The event loop may run other coroutines between two awards.'''
+        if event_log.active:
+            event_log.active.negotiation(self.bidding_manager, self.tasks[0].name, len(self.available_resource_agents))
+        try:
+            for task in self.tasks:
+                for chunk in self.split_task(task):
+                    self.award_task(chunk)
+                    await asyncio.sleep(0)
+        finally:
+            self.release_resource_agents()
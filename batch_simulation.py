@@ -0,0 +1,244 @@
+'''The batch simulation module runs many replications of a scenario at once by holding the state of all of them in NumPy arrays.
+It supports homogeneous scenarios, i.e. a single bidding manager whose resource agents are all able to perform the same tasks, like test runs 0 to 2.
+Such a bidding manager awards every task to the agent with the fewest tasks yet to start, ties going to the agent listed first, as the least loaded bid strategy does.
+
+All replications advance in lockstep over the same ticks of virtual time the discrete-event simulation of a scenario uses to check its goal.
+Within a tick every replication processes its own events in chronological order, so without variation a replication reproduces the discrete-event simulation of the scenario.
+Task finishes at the same point in time are processed in the order of the agents, which may differ from the discrete-event simulation if such tasks compete for resources.
+The time of every task can be varied by a log-normal factor, which turns the replications into a Monte Carlo study of the goal time.
+Run python3 batch_simulation.py --help for all options.'''
+
+import argparse
+import math
+
+import numpy as np
+
+from scenario import load_scenario
+from study_statistics import PERCENTILES, RunningStatistics
+from task import TASK_TYPES
+
+
+# Interval of virtual time the goal is checked at. It has to match the interval run_scenario() sleeps for
+TICK = 0.01
+
+
+def unsupported_feature(scenario):
+    '''Returns a message naming the feature of a scenario definition batch simulations do not support, or None if the scenario can be run as a batch simulation.'''
+    agent_groups = scenario['bidding_manager']['agents']
+    if len(agent_groups) != 1 or 'bidding_manager' in agent_groups[0] or 'address' in agent_groups[0] or agent_groups[0].get('remote', False):
+        return 'Batch simulations require a single group of resource agents'
+    if agent_groups[0].get('task_schedule', 'fifo') != 'fifo':
+        return 'Batch simulations only support FIFO task schedules'
+    definition = scenario['bidding_manager']
+    if definition.get('bid_strategy', 'least_loaded') != 'least_loaded' or definition.get('hold_back_tasks', False) or definition.get('work_stealing', False):
+        return 'Batch simulations only support the least loaded bid strategy without holding back tasks or work stealing'
+    for task_injection in scenario['tasks']:
+        if task_injection['task'] not in agent_groups[0]['compatible_tasks']:
+            return 'No resource agent is able to perform task ' + str(task_injection['task'])
+        if task_injection.get('quantity', 1) != 1:
+            return 'Batch simulations do not support batched tasks'
+        if 'priority' in task_injection or 'deadline' in task_injection:
+            return 'Batch simulations do not support priorities and deadlines'
+    return None
+
+
+class BatchSimulation:
+    '''Batch simulation class running replications of a homogeneous scenario definition.
+    Time variation is the coefficient of variation of task times. Zero keeps task times fixed, so all replications are equal.
+    Raises a ValueError if the scenario is not supported, see unsupported_feature().'''
+
+    def __init__(self, scenario, replications, time_variation=0.0, seed=0):
+        unsupported = unsupported_feature(scenario)
+        if unsupported:
+            raise ValueError(unsupported)
+        self.num_agents = scenario['bidding_manager']['agents'][0].get('count', 1)
+        self.injections = sorted(scenario['tasks'], key=lambda task_injection: task_injection.get('time', 0.0))
+
+        self.task_names = list(dict.fromkeys(task_injection['task'] for task_injection in self.injections))
+        task_types = [TASK_TYPES[task_name] for task_name in self.task_names]
+        self.resource_names = list(scenario['resources'])
+        for task_type in task_types:
+            for resource_name in list(task_type.inputs) + list(task_type.outputs):
+                if resource_name not in self.resource_names:
+                    self.resource_names.append(resource_name)
+        columns = {resource_name: column for column, resource_name in enumerate(self.resource_names)}
+        self.initial_resources = np.array([scenario['resources'].get(resource_name, 0) for resource_name in self.resource_names], dtype=float)
+        self.task_inputs = np.zeros((len(task_types), len(self.resource_names)))
+        self.task_outputs = np.zeros((len(task_types), len(self.resource_names)))
+        for task_index, task_type in enumerate(task_types):
+            for resource_name, amount in task_type.inputs.items():
+                self.task_inputs[task_index, columns[resource_name]] = amount
+            for resource_name, amount in task_type.outputs.items():
+                self.task_outputs[task_index, columns[resource_name]] = amount
+        self.task_times = np.array([task_type.time for task_type in task_types])
+        self.goal_columns = np.array([columns[resource_name] for resource_name in scenario['goal']], dtype=int)
+        self.goal_amounts = np.array(list(scenario['goal'].values()), dtype=float)
+
+        stop = scenario.get('stop', {})
+        self.time_limit = stop.get('max_time', math.inf)
+        if 'optimal_time_factor' in stop:
+            total_task_time = sum(TASK_TYPES[task_injection['task']].time * task_injection.get('count', 1) for task_injection in self.injections)
+            self.time_limit = min(self.time_limit, total_task_time / self.num_agents * stop['optimal_time_factor'])
+
+        self.replications = replications
+        self.time_variation = time_variation
+        self.random = np.random.default_rng(seed)
+
+
+    def durations(self, task_indices):
+        '''Used internally to return the durations of tasks of the given task indices.'''
+        durations = self.task_times[task_indices]
+        if self.time_variation > 0:
+            # Log-normal factors with a mean of one
+            sigma = math.sqrt(math.log(1 + self.time_variation ** 2))
+            durations = durations * self.random.lognormal(-sigma ** 2 / 2, sigma, len(durations))
+        return durations
+
+
+    def run(self):
+        '''Runs all replications and returns an array of their goal times, which are 0 if a replication did not accomplish the goal.'''
+        num_replications = self.replications
+        num_agents = self.num_agents
+        all_replications = np.arange(num_replications)
+        capacity = sum(task_injection.get('count', 1) for task_injection in self.injections)
+
+        self.resources = np.tile(self.initial_resources, (num_replications, 1))
+        # Task schedules of all agents. Tasks are never added again once started, so the schedules are plain arrays with a head and a tail
+        self.schedules = np.zeros((num_replications, num_agents, capacity), dtype=np.int16)
+        self.heads = np.zeros((num_replications, num_agents), dtype=int)
+        self.tails = np.zeros((num_replications, num_agents), dtype=int)
+        # Task index of the current task of every agent or -1 if the agent is idle
+        self.current_tasks = np.full((num_replications, num_agents), -1)
+        # Finish time of the current task or infinity if the agent is idle or waiting for the inputs of its current task
+        self.finish_times = np.full((num_replications, num_agents), math.inf)
+        self.waiting = np.zeros((num_replications, num_agents), dtype=bool)
+        self.request_numbers = np.zeros((num_replications, num_agents), dtype=int)
+        self.num_requests = 0
+
+        goal_times = np.zeros(num_replications)
+        active = np.ones(num_replications, dtype=bool)
+        pending_injections = list(self.injections)
+
+        def inject_tasks(until):
+            while len(pending_injections) > 0 and pending_injections[0].get('time', 0.0) <= until:
+                task_injection = pending_injections.pop(0)
+                task_index = self.task_names.index(task_injection['task'])
+                for _ in range(task_injection.get('count', 1)):
+                    agents = np.argmin(self.tails - self.heads, axis=1)
+                    self.schedules[all_replications, agents, self.tails[all_replications, agents]] = task_index
+                    self.tails[all_replications, agents] += 1
+
+        inject_tasks(0.0)
+        run_time = 0.0
+        previous_run_time = 0.0
+        while active.any() and previous_run_time <= self.time_limit:
+            goal_accomplished = active & np.all(self.resources[:, self.goal_columns] >= self.goal_amounts, axis=1)
+            goal_times[goal_accomplished] = run_time
+            active &= ~goal_accomplished
+            if len(pending_injections) == 0:
+                # Replications without running tasks or tasks to start never change again
+                startable = (self.current_tasks == -1) & (self.heads < self.tails)
+                active &= ~np.all(np.isinf(self.finish_times) & ~startable, axis=1)
+
+            inject_tasks(run_time)
+            until = run_time + TICK
+            self.start_idle_agents(run_time)
+            self.finish_tasks(np.flatnonzero(active), until)
+            previous_run_time = run_time
+            run_time = until
+        return goal_times
+
+
+    def start_idle_agents(self, start_time):
+        '''Used internally to let idle agents start the next task in their schedules, like agents of a discrete-event simulation do after being awarded a task.'''
+        startable = (self.current_tasks == -1) & (self.heads < self.tails)
+        if not startable.any():
+            return
+        for agent in range(self.num_agents):
+            replications = np.flatnonzero(startable[:, agent])
+            if len(replications) > 0:
+                self.start_next_tasks(replications, np.full(len(replications), agent), np.full(len(replications), start_time))
+
+
+    def finish_tasks(self, replications, until):
+        '''Used internally to process all task finishes up to until in the given replications. Every pass processes the earliest finish of every replication.'''
+        while len(replications) > 0:
+            agents = np.argmin(self.finish_times[replications], axis=1)
+            finish_times = self.finish_times[replications, agents]
+            due = finish_times <= until
+            replications, agents, finish_times = replications[due], agents[due], finish_times[due]
+            if len(replications) == 0:
+                return
+            self.resources[replications] += self.task_outputs[self.current_tasks[replications, agents]]
+            self.current_tasks[replications, agents] = -1
+            self.finish_times[replications, agents] = math.inf
+            self.grant_resource_requests(replications, finish_times)
+            self.start_next_tasks(replications, agents, finish_times)
+
+
+    def start_next_tasks(self, replications, agents, start_times):
+        '''Used internally to start the next task of one agent per replication. Agents whose inputs are not available wait for them like a resource request of the discrete-event simulation.'''
+        scheduled = self.heads[replications, agents] < self.tails[replications, agents]
+        replications, agents, start_times = replications[scheduled], agents[scheduled], start_times[scheduled]
+        task_indices = self.schedules[replications, agents, self.heads[replications, agents]].astype(int)
+        self.heads[replications, agents] += 1
+        self.current_tasks[replications, agents] = task_indices
+        available = np.all(self.resources[replications] >= self.task_inputs[task_indices], axis=1)
+        self.resources[replications[available]] -= self.task_inputs[task_indices[available]]
+        self.finish_times[replications[available], agents[available]] = start_times[available] + self.durations(task_indices[available])
+        waiting_replications, waiting_agents = replications[~available], agents[~available]
+        self.waiting[waiting_replications, waiting_agents] = True
+        self.request_numbers[waiting_replications, waiting_agents] = self.num_requests + np.arange(len(waiting_replications))
+        self.num_requests += len(waiting_replications)
+
+
+    def grant_resource_requests(self, replications, grant_times):
+        '''Used internally to start the tasks of waiting agents whose inputs became available, in the order they requested them.'''
+        waiting = self.waiting[replications]
+        if not waiting.any():
+            return
+        request_order = np.argsort(np.where(waiting, self.request_numbers[replications], np.iinfo(int).max), axis=1)
+        for rank in range(self.num_agents):
+            agents = request_order[:, rank]
+            requesting = self.waiting[replications, agents]
+            if not requesting.any():
+                return
+            task_indices = self.current_tasks[replications, agents]
+            granted = requesting & np.all(self.resources[replications] >= self.task_inputs[task_indices], axis=1)
+            granted_replications, granted_agents, task_indices = replications[granted], agents[granted], task_indices[granted]
+            self.resources[granted_replications] -= self.task_inputs[task_indices]
+            self.waiting[granted_replications, granted_agents] = False
+            self.finish_times[granted_replications, granted_agents] = grant_times[granted] + self.durations(task_indices)
+
+
+def main():
+    '''Main method. Runs replications of a scenario as a batch simulation and prints the statistics of their goal times.'''
+    parser = argparse.ArgumentParser(description='Runs many replications of a homogeneous scenario at once as a vectorized simulation.')
+    parser.add_argument('scenario', help='scenario file with a single group of resource agents, e.g. scenarios/test_run_0.json')
+    parser.add_argument('--replications', type=int, default=1000, help='number of replications')
+    parser.add_argument('--time-variation', type=float, default=0.0, help='coefficient of variation of task times. Zero makes all replications equal to the discrete-event simulation')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the task time variation')
+    parser.add_argument('--output', metavar='FILE', help='.npy file the goal times of all replications are saved to')
+    args = parser.parse_args()
+
+    scenario = load_scenario(args.scenario)
+    unsupported = unsupported_feature(scenario)
+    if unsupported:
+        parser.error(unsupported + ', so ' + args.scenario + ' cannot be run as a batch simulation. Run it with python3 main.py --simulate instead')
+    goal_times = BatchSimulation(scenario, args.replications, args.time_variation, args.seed).run()
+    if args.output:
+        np.save(args.output, goal_times)
+
+    statistics = RunningStatistics()
+    for goal_time in goal_times:
+        statistics.add(float(goal_time))
+    lower, upper = statistics.confidence_interval()
+    print(scenario['name'], 'mean is:', statistics.mean)
+    print(scenario['name'], 'sd is:', statistics.standard_deviation())
+    print(scenario['name'], '95% confidence interval is:', lower, 'to', upper)
+    print(scenario['name'], 'percentiles are:', ', '.join(str(percent) + '%: ' + str(statistics.percentile(percent)) for percent in PERCENTILES))
+    print(scenario['name'], 'goal accomplished in', int(np.count_nonzero(goal_times)), 'of', len(goal_times), 'replications')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+'''The benchmark file measures the coordination overhead of the SFCS.
+All benchmarks use tasks without inputs, outputs and execution time, so only negotiating, dispatching and storage access is measured.
+Every benchmark is repeated. The median of the repetitions is reported together with their spread, so comparisons against a stored baseline are not dominated by noise.
+Results are written as JSON and can be compared against a stored baseline. Run python3 benchmark.py --help for all options.'''
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+
+from resource_storage import ResourceStorage
+from sfcs import ResourceAgent, BiddingManager, RecursiveResourceAgent
+from task import Task
+
+
+class BenchmarkTask(Task):
+    '''Task without inputs, outputs and execution time. The times it was submitted and awarded are recorded.'''
+    __slots__ = ('submit_time', 'award_time')
+    name = 'Benchmark_Task'
+
+    def __init__(self, resource_storage):
+        Task.__init__(self, resource_storage)
+        self.submit_time = 0.0
+        self.award_time = 0.0
+
+
+# Number of tasks scheduled between two checks of the elapsed time
+TASKS_PER_CHECK = 100
+
+# Number of resource agents at the end of the chains of recursive resource agents the holon depth curve is measured with
+HOLON_AGENTS = 10
+
+
+class AwardCounter:
+    '''Counter of tasks awarded to resource agents. Allows waiting until a given number of tasks was awarded.'''
+    def __init__(self):
+        self.count = 0
+        self.count_changed_condition = threading.Condition()
+
+
+    def increment(self):
+        '''Counts one awarded task.'''
+        with self.count_changed_condition:
+            self.count += 1
+            self.count_changed_condition.notify_all()
+
+
+    def wait_for(self, count):
+        '''Waits until at least count tasks were awarded.'''
+        with self.count_changed_condition:
+            self.count_changed_condition.wait_for(lambda: self.count >= count)
+
+
+class TimingResourceAgent(ResourceAgent):
+    '''Resource agent recording when tasks are awarded to it.'''
+    def __init__(self, compatible_tasks, award_counter):
+        ResourceAgent.__init__(self, compatible_tasks)
+        self.award_counter = award_counter
+
+
+    def add_task_to_schedule(self, task):
+        task.award_time = time.perf_counter()
+        ResourceAgent.add_task_to_schedule(self, task)
+        self.award_counter.increment()
+
+
+def build_holon(num_agents, depth, resource_storage, award_counter):
+    '''Creates a chain of depth recursive resource agents with num_agents timing resource agents at its end.
+    Returns the top level bidding manager and all created resource agents.'''
+    resource_agents = []
+    leaf_bm = BiddingManager(resource_storage)
+    for _ in range(num_agents):
+        r_agent = TimingResourceAgent(['Benchmark_Task'], award_counter)
+        r_agent.run()
+        leaf_bm.add_manufacturing_resource(r_agent)
+        resource_agents.append(r_agent)
+    bm = leaf_bm
+    for _ in range(depth):
+        parent_bm = BiddingManager(resource_storage)
+        rec_r_agent = RecursiveResourceAgent(bm, ['Benchmark_Task'])
+        rec_r_agent.run()
+        parent_bm.add_manufacturing_resource(rec_r_agent)
+        resource_agents.append(rec_r_agent)
+        bm = parent_bm
+    return bm, resource_agents
+
+
+def percentile(values, fraction):
+    '''Returns the nearest-rank percentile of a list of values.'''
+    sorted_values = sorted(values)
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def benchmark_negotiation(num_agents, duration, depth=0):
+    '''Returns the number of tasks negotiated per second when tasks are scheduled one at a time with schedule_task() for duration seconds, so every task is negotiated on its own.
+    The time until the last task was awarded is included. Tasks are scheduled to a holon of the given depth.'''
+    resource_storage = ResourceStorage()
+    award_counter = AwardCounter()
+    bm, resource_agents = build_holon(num_agents, depth, resource_storage, award_counter)
+
+    num_tasks = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        for _ in range(TASKS_PER_CHECK):
+            bm.schedule_task(BenchmarkTask(resource_storage))
+        num_tasks += TASKS_PER_CHECK
+    award_counter.wait_for(num_tasks)
+    elapsed_time = time.perf_counter() - start_time
+
+    for resource_agent in resource_agents:
+        resource_agent.stop()
+    return num_tasks / elapsed_time
+
+
+def benchmark_dispatch_latency(num_agents, duration):
+    '''Returns the p50 and p99 latency in milliseconds from calling schedule_task() until the task is added to a resource agent's schedule.
+    Tasks are scheduled for duration seconds, each one after the previous one was awarded, so the latency does not include waiting behind other negotiations.'''
+    resource_storage = ResourceStorage()
+    award_counter = AwardCounter()
+    bm, resource_agents = build_holon(num_agents, 0, resource_storage, award_counter)
+
+    latencies = []
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        task = BenchmarkTask(resource_storage)
+        task.submit_time = time.perf_counter()
+        bm.schedule_task(task)
+        award_counter.wait_for(len(latencies) + 1)
+        latencies.append((task.award_time - task.submit_time) * 1000.0)
+
+    for resource_agent in resource_agents:
+        resource_agent.stop()
+    return percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+def benchmark_storage(num_threads, num_operations):
+    '''Returns the number of pop_resource() and push_resource() calls per second when num_threads threads contend for the same resource.'''
+    resource_storage = ResourceStorage()
+    resource_storage.resources = {'benchmark_resource': num_threads}
+
+    def pop_and_push():
+        for _ in range(num_operations):
+            resource_storage.pop_resource('benchmark_resource', 1)
+            resource_storage.push_resource('benchmark_resource', 1)
+
+    threads = [threading.Thread(target=pop_and_push) for _ in range(num_threads)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_time = time.perf_counter() - start_time
+    return 2 * num_threads * num_operations / elapsed_time
+
+
+def run_benchmarks(duration, num_operations, agent_counts, holon_depths):
+    '''Runs all benchmarks once and returns their results. Metrics map names to a value, a unit and whether higher values are better.
+    Negotiation and dispatch benchmarks run for duration seconds each, the storage benchmark for num_operations operations per thread.
+    The agent count curve is measured without recursive resource agents and the holon depth curve with HOLON_AGENTS resource agents, so depth 0 is part of the agent count curve.'''
+    metrics = {}
+    latency_p50, latency_p99 = benchmark_dispatch_latency(HOLON_AGENTS, duration)
+    metrics['dispatch_latency_p50'] = {'value': latency_p50, 'unit': 'ms', 'higher_is_better': False}
+    metrics['dispatch_latency_p99'] = {'value': latency_p99, 'unit': 'ms', 'higher_is_better': False}
+    metrics['storage_throughput'] = {'value': benchmark_storage(8, num_operations), 'unit': 'operations/s', 'higher_is_better': True}
+    for num_agents in agent_counts:
+        metrics['negotiation_throughput_agents_' + str(num_agents)] = {'value': benchmark_negotiation(num_agents, duration), 'unit': 'tasks/s', 'higher_is_better': True}
+    for depth in holon_depths:
+        if depth == 0 and HOLON_AGENTS in agent_counts:
+            continue
+        metrics['negotiation_throughput_depth_' + str(depth)] = {'value': benchmark_negotiation(HOLON_AGENTS, duration, depth), 'unit': 'tasks/s', 'higher_is_better': True}
+    return {'duration': duration, 'metrics': metrics}
+
+
+def summarize_results(results_list):
+    '''Summarizes the results of repeated benchmark runs. The value of every metric is the median of the runs and its spread is half the range of the runs relative to the median.'''
+    summary = {'duration': results_list[0]['duration'], 'repeat': len(results_list), 'metrics': {}}
+    for name, metric in results_list[0]['metrics'].items():
+        samples = [results['metrics'][name]['value'] for results in results_list]
+        median = statistics.median(samples)
+        spread = (max(samples) - min(samples)) / 2 / median if median else 0.0
+        summary['metrics'][name] = dict(metric, value=median, spread=spread, samples=samples)
+    return summary
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    '''Prints the change of every metric compared to the baseline. Returns the names of metrics that got worse by more than tolerance plus the spreads of the metric and its baseline.
+    Changes within the spreads are indistinguishable from noise.'''
+    regressions = []
+    for name, metric in results['metrics'].items():
+        if name not in baseline['metrics']:
+            continue
+        baseline_metric = baseline['metrics'][name]
+        baseline_value = baseline_metric['value']
+        ratio = metric['value'] / baseline_value if baseline_value else float('inf')
+        allowed_change = tolerance + metric.get('spread', 0.0) + baseline_metric.get('spread', 0.0)
+        if metric['higher_is_better']:
+            regressed = ratio < 1.0 - allowed_change
+        else:
+            regressed = ratio > 1.0 + allowed_change
+        if regressed:
+            regressions.append(name)
+        print(name + ':', metric['value'], metric['unit'], '(spread', str(round(metric.get('spread', 0.0), 3)) + ',', 'baseline', str(baseline_value) + ',', 'ratio', str(round(ratio, 3)) + ')', 'REGRESSION' if regressed else '')
+    return regressions
+
+
+def main():
+    '''Main method. Runs the benchmark suite and writes the results as JSON.'''
+    parser = argparse.ArgumentParser(description='Measures negotiation throughput, dispatch latency, storage throughput and scaling of the SFCS.')
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds every negotiation and dispatch benchmark schedules tasks for')
+    parser.add_argument('--operations', type=int, default=10000, help='number of storage operations per thread of the storage benchmark')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1, 10, 100, 1000], help='agent counts of the scaling curve')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 4], help='holon depths of the scaling curve')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times every benchmark is run. The median of every metric is kept')
+    parser.add_argument('--output', default='benchmark_results.json', help='file the results are written to')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change of a metric that counts as a regression')
+    args = parser.parse_args()
+
+    results = summarize_results([run_benchmarks(args.duration, args.operations, args.agents, args.depths) for _ in range(args.repeat)])
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_to_baseline(results, baseline, args.tolerance):
+            sys.exit(1)
+    else:
+        for name, metric in results['metrics'].items():
+            print(name + ':', metric['value'], metric['unit'], '(spread', str(round(metric['spread'], 3)) + ')')
+
+
+if __name__ == '__main__':
+    main()
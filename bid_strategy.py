@@ -0,0 +1,176 @@
+'''The bid strategy module defines how negotiation agents generate bids for resource agents.
+A bid strategy is shared by all negotiations of a bidding manager. State only needed during a single negotiation is kept on the negotiation agent.'''
+
+import threading
+
+import numpy as np
+
+
+class LoadBoard:
+    '''Board holding the loads of the resource agents of a bidding manager in NumPy arrays indexed by the agents' indices, so bid strategies score all candidates of an award at once.
+    Resource agents update their entry whenever their schedule or current task changes, while holding the lock of their schedule.
+    Agents whose load depends on other agents, like recursive resource agents, are marked as dynamic. Their entries are not used and bid strategies ask them for their load instead.'''
+
+    def __init__(self):
+        self.size = 0
+        self.queue_lengths = np.zeros(0)
+        # Summed time of the scheduled tasks, and duration and start time of the current task, which is zero without one
+        self.scheduled_times = np.zeros(0)
+        self.current_task_durations = np.zeros(0)
+        self.current_task_start_times = np.zeros(0)
+        self.dynamic = np.zeros(0, dtype=bool)
+        self.lock = threading.Lock()
+
+
+    def add(self, dynamic):
+        '''Adds an entry for a resource agent and returns its index. The arrays grow by doubling, so adding n agents costs O(n) in total.'''
+        with self.lock:
+            if self.size == len(self.dynamic):
+                capacity = max(16, 2 * self.size)
+                self.queue_lengths = np.resize(self.queue_lengths, capacity)
+                self.scheduled_times = np.resize(self.scheduled_times, capacity)
+                self.current_task_durations = np.resize(self.current_task_durations, capacity)
+                self.current_task_start_times = np.resize(self.current_task_start_times, capacity)
+                self.dynamic = np.resize(self.dynamic, capacity)
+            index = self.size
+            self.queue_lengths[index] = 0.0
+            self.scheduled_times[index] = 0.0
+            self.current_task_durations[index] = 0.0
+            self.current_task_start_times[index] = 0.0
+            self.dynamic[index] = dynamic
+            self.size += 1
+            return index
+
+
+    def update(self, index, queue_length, scheduled_time, current_task_duration, current_task_start_time):
+        '''Updates the entry of the resource agent at index.'''
+        with self.lock:
+            self.queue_lengths[index] = queue_length
+            self.scheduled_times[index] = scheduled_time
+            self.current_task_durations[index] = current_task_duration
+            self.current_task_start_times[index] = current_task_start_time
+
+
+class BidStrategy:
+    '''Base class of bid strategies. The resource agent with the highest bid is awarded a task and bids of zero or less are never awarded.
+    New strategies can be created by inheriting from this class and overriding generate_bid().'''
+
+    def generate_bid(self, task, resource_agent):
+        '''Returns the bid of resource_agent for task.'''
+        raise NotImplementedError
+
+
+    def get_best_r_agent(self, n_agent):
+        '''Returns the resource agent with the highest bid for the negotiation agent's current task, or None if no agent placed a positive bid.
+        Ties are awarded to the agent listed first.'''
+        max_bid = 0
+        best_resource_agent = None
+        for resource_agent in n_agent.available_r_agents:
+            bid = self.generate_bid(n_agent.task, resource_agent)
+            if bid > max_bid:
+                max_bid = bid
+                best_resource_agent = resource_agent
+        return best_resource_agent
+
+
+class LeastLoadedBidStrategy(BidStrategy):
+    '''Bid strategy according to the method given in the paper. The less load a resource agent has, the higher its bid. The load is the number of tasks the agent has yet to start.
+    Loads are read from the load board of the bidding manager as one NumPy array per award, so no candidate has to be asked for its load, except dynamic ones.
+    As agents keep the board up to date, loads which decreased while a task agent awards several tasks, e.g. because an agent finished a task, are taken into account as well.'''
+
+    def load(self, resource_agent):
+        '''Returns the load the bid of resource_agent is based on.'''
+        return resource_agent.queue_length()
+
+
+    def board_loads(self, load_board, indices, now):
+        '''Returns the loads of the resource agents at indices of a load board as a NumPy array. Now is the current time of the agents' clock.'''
+        return load_board.queue_lengths[indices]
+
+
+    def generate_bid(self, task, resource_agent):
+        return 1.0 / (1 + self.load(resource_agent))
+
+
+    def loads(self, n_agent):
+        '''Returns the loads of all resource agents of a negotiation agent as a NumPy array.
+        The board indices of the agents are looked up once per negotiation agent and kept as its bid state.'''
+        resource_agents = n_agent.available_r_agents
+        load_board = n_agent.load_board
+        if load_board is None:
+            return np.fromiter((self.load(resource_agent) for resource_agent in resource_agents), dtype=float, count=len(resource_agents))
+        if n_agent.bid_state is None:
+            indices = np.fromiter((resource_agent.index for resource_agent in resource_agents), dtype=np.intp, count=len(resource_agents))
+            n_agent.bid_state = (indices, np.flatnonzero(load_board.dynamic[indices]))
+        indices, dynamic_positions = n_agent.bid_state
+        loads = self.board_loads(load_board, indices, resource_agents[0].now())
+        for position in dynamic_positions:
+            loads[position] = self.load(resource_agents[position])
+        return loads
+
+
+    def get_best_r_agent(self, n_agent):
+        # The agent of the lowest load has the highest bid. Ties are awarded to the agent listed first
+        if len(n_agent.available_r_agents) == 0:
+            return None
+        return n_agent.available_r_agents[int(np.argmin(self.loads(n_agent)))]
+
+
+class CompletionTimeBidStrategy(LeastLoadedBidStrategy):
+    '''Bid strategy based on the estimated completion time of resource agents instead of the number of scheduled tasks, so mixed task durations are balanced.
+    The completion time is the time of all scheduled tasks plus the remaining time of the current task. Agents keep it up to date as tasks are scheduled and performed, so every bid is O(1).'''
+
+    def load(self, resource_agent):
+        return resource_agent.estimated_completion_time()
+
+
+    def board_loads(self, load_board, indices, now):
+        # Computed like ResourceAgent.estimated_completion_time(), so both give the same estimates. Without a current task the remaining time is zero
+        return load_board.scheduled_times[indices] + np.maximum(0.0, load_board.current_task_durations[indices] - (now - load_board.current_task_start_times[indices]))
+
+
+class DeadlineBidStrategy(CompletionTimeBidStrategy):
+    '''Bid strategy accounting for the deadlines of tasks. Agents able to complete a task by its deadline bid higher than all agents which are not.
+    Among the agents meeting the deadline the one with the lowest estimated completion time of all its tasks wins, which keeps the load balanced.
+    If no agent meets the deadline, the agent completing the task earliest wins, which keeps its lateness low. Tasks without deadline are awarded like by the completion time strategy.
+    The time a task takes to be completed by an agent depends on the task and the order of the agent's schedule, so it is estimated again for every candidate of every award.
+    Completion times of all tasks come from the load board, so an award costs one estimate per candidate, which heap task schedules answer in O(ORDINAL_BITS) steps from running sums.'''
+
+    def deadline_bid(self, task, now, task_completion_time, completion_time):
+        '''Used internally to return the bid for a task with a deadline, given the estimated time an agent completes the task at and the time it completes all its tasks at.'''
+        if now + task_completion_time <= task.deadline:
+            return 2.0 + 1.0 / (1 + completion_time)
+        return 1.0 / (1 + task_completion_time)
+
+
+    def generate_bid(self, task, resource_agent):
+        if task.deadline is None:
+            return 1.0 / (1 + resource_agent.estimated_completion_time())
+        return self.deadline_bid(task, resource_agent.now(), resource_agent.estimated_completion_time(task), resource_agent.estimated_completion_time())
+
+
+    def get_best_r_agent(self, n_agent):
+        task = n_agent.task
+        if task.deadline is None:
+            return CompletionTimeBidStrategy.get_best_r_agent(self, n_agent)
+        resource_agents = n_agent.available_r_agents
+        if len(resource_agents) == 0:
+            return None
+        completion_times = self.loads(n_agent)
+        now = resource_agents[0].now()
+        max_bid = 0
+        best_resource_agent = None
+        for resource_agent, completion_time in zip(resource_agents, completion_times):
+            bid = self.deadline_bid(task, now, resource_agent.estimated_completion_time(task), completion_time)
+            if bid > max_bid:
+                max_bid = bid
+                best_resource_agent = resource_agent
+        return best_resource_agent
+
+
+# Maps names of bid strategies to their classes. This is used to select bid strategies in scenario definitions.
+BID_STRATEGIES = {
+    'least_loaded': LeastLoadedBidStrategy,
+    'completion_time': CompletionTimeBidStrategy,
+    'deadline': DeadlineBidStrategy,
+}
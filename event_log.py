@@ -0,0 +1,183 @@
+'''The event log module writes every negotiation, award, task start and finish and resource storage change of a run to a compact append-only binary log, which the replay module reads.
+Like instrumentation the event log is disabled by default. Code paths check the module's active attribute, which is None unless enable() was called.
+
+A log is a sequence of records. Every record starts with a header holding its type and time. Event records continue with two ids and a value.
+Ids refer to names, which are defined by name records holding the id and the UTF-8 encoded name. Objects like agents are named by their class name and a number, tasks by a sequence number.
+The first record of a log is a scenario record holding the JSON scenario definition of the run.'''
+
+import itertools
+import json
+import struct
+import threading
+
+from simulation import RealTimeClock
+
+
+# Record types
+SCENARIO = 0
+NAME = 1
+ARRIVAL = 2
+NEGOTIATION = 3
+AWARD = 4
+TASK_START = 5
+TASK_FINISH = 6
+STORAGE_CHANGE = 7
+GOAL_ACCOMPLISHED = 8
+PRIORITY = 9
+DEADLINE = 10
+
+# Record header of type and time
+HEADER = struct.Struct('<Bd')
+# Body of event records of two ids and a value
+EVENT = struct.Struct('<IId')
+# Body of name records and scenario records of an id and the length of the following bytes
+BLOB = struct.Struct('<II')
+
+# The currently active event log or None if the event log is disabled
+active = None
+
+
+def enable(path, scenario, clock=None):
+    '''Enables the event log and returns the new active event log writing to path. The log starts with the scenario definition and times are taken from clock, which defaults to wall-clock time.'''
+    global active
+    active = EventLog(path, scenario, clock)
+    return active
+
+
+def disable():
+    '''Closes and disables the active event log.'''
+    global active
+    if active:
+        active.close()
+    active = None
+
+
+class EventLog:
+    '''Event log class writing records to a buffered binary file. Times are written relative to the creation of the log.
+    Arrival records name the task and the task type and hold its quantity. Tasks of a priority other than zero and tasks with a deadline are followed by priority and deadline records naming the task and the task type. Negotiation records name the bidding manager and the task type and hold the number of candidates.
+    Award, task start and task finish records name the task and the resource agent. Storage change records name the resource and hold its new amount.'''
+
+    def __init__(self, path, scenario, clock=None):
+        self.clock = clock if clock else RealTimeClock()
+        self.start_time = self.clock.now()
+        self.lock = threading.Lock()
+        self.log_file = open(path, 'wb')
+        self.name_ids = {}
+        self.type_counters = {}
+        self.task_ids = itertools.count()
+        scenario_bytes = json.dumps(scenario).encode('utf-8')
+        self.log_file.write(HEADER.pack(SCENARIO, 0.0) + BLOB.pack(0, len(scenario_bytes)) + scenario_bytes)
+
+
+    def now(self):
+        '''Returns the time since the creation of the log.'''
+        return self.clock.now() - self.start_time
+
+
+    def name_id(self, name):
+        '''Used internally to return the id of a name, which is a string or an object, and define it if it is new. The caller has to hold the lock.'''
+        key = name if isinstance(name, str) else id(name)
+        if key not in self.name_ids:
+            name_id = len(self.name_ids)
+            if isinstance(name, str):
+                self.name_ids[key] = (name, name_id)
+            else:
+                # Like instrumentation labels, objects are numbered per class and kept alive so their id is never reused
+                type_name = type(name).__name__
+                self.type_counters[type_name] = self.type_counters.get(type_name, 0) + 1
+                self.name_ids[key] = (name, name_id)
+                name = type_name + ' ' + str(self.type_counters[type_name] - 1)
+            name_bytes = name.encode('utf-8')
+            self.log_file.write(HEADER.pack(NAME, 0.0) + BLOB.pack(name_id, len(name_bytes)) + name_bytes)
+        return self.name_ids[key][1]
+
+
+    def task_name(self, task):
+        '''Used internally to return the name of a task, which is its sequence number in the log.'''
+        if not hasattr(task, 'log_id'):
+            task.log_id = 'Task ' + str(next(self.task_ids))
+        return task.log_id
+
+
+    def write(self, record_type, first, second, value=0.0):
+        '''Writes an event record. First and second are strings or objects, which are replaced by their ids.'''
+        event_time = self.now()
+        with self.lock:
+            # Agents which are still finishing their last task may write after the log was closed
+            if self.log_file.closed:
+                return
+            record = HEADER.pack(record_type, event_time) + EVENT.pack(self.name_id(first), self.name_id(second), value)
+            self.log_file.write(record)
+
+
+    def arrival(self, task):
+        '''Records that task was submitted to the shop floor.'''
+        self.write(ARRIVAL, self.task_name(task), task.name, task.quantity)
+        if task.priority != 0:
+            self.write(PRIORITY, self.task_name(task), task.name, task.priority)
+        if task.deadline is not None:
+            # Deadlines are points in time on the clock, so they are written relative to the creation of the log like all times
+            self.write(DEADLINE, self.task_name(task), task.name, task.deadline - self.start_time)
+
+
+    def negotiation(self, bidding_manager, task_name, num_candidates):
+        '''Records that bidding_manager started negotiating tasks of task_name with num_candidates resource agents.'''
+        self.write(NEGOTIATION, bidding_manager, task_name, num_candidates)
+
+
+    def award(self, task, resource_agent):
+        '''Records that task was awarded to resource_agent.'''
+        self.write(AWARD, self.task_name(task), resource_agent)
+
+
+    def task_started(self, task, resource_agent):
+        '''Records that resource_agent started performing task.'''
+        self.write(TASK_START, self.task_name(task), resource_agent)
+
+
+    def task_finished(self, task, resource_agent):
+        '''Records that resource_agent finished performing task.'''
+        self.write(TASK_FINISH, self.task_name(task), resource_agent)
+
+
+    def storage_changed(self, resource_name, amount):
+        '''Records that the amount of resource_name in storage changed to amount.'''
+        self.write(STORAGE_CHANGE, resource_name, resource_name, amount)
+
+
+    def goal_accomplished(self, goal_accomplished_time):
+        '''Records the goal time the scenario determined.'''
+        self.write(GOAL_ACCOMPLISHED, 'goal', 'goal', goal_accomplished_time)
+
+
+    def close(self):
+        '''Flushes and closes the log file.'''
+        with self.lock:
+            self.log_file.close()
+
+
+def read(path):
+    '''Reads a log and returns the scenario definition and the list of event records as tuples of type, time, first name, second name and value.'''
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+    names = {}
+    scenario = None
+    records = []
+    offset = 0
+    while offset < len(data):
+        record_type, record_time = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if record_type in (SCENARIO, NAME):
+            name_id, length = BLOB.unpack_from(data, offset)
+            offset += BLOB.size
+            text = data[offset:offset + length].decode('utf-8')
+            offset += length
+            if record_type == SCENARIO:
+                scenario = json.loads(text)
+            else:
+                names[name_id] = text
+        else:
+            first, second, value = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            records.append((record_type, record_time, names[first], names[second], value))
+    return scenario, records
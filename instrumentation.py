@@ -0,0 +1,267 @@
+'''The instrumentation module collects counters, latency histograms and a task execution timeline of a running SFCS.
+Instrumentation is disabled by default. Code paths check the module's active attribute, which is None unless enable() was called, so disabled instrumentation costs a single attribute lookup.
+Locks created while instrumentation is enabled record how long threads waited to acquire them, so enable() has to be called before the bidding managers, agents and resource storage are created.'''
+
+import json
+import threading
+
+from simulation import RealTimeClock
+
+
+# The currently active instrumentation or None if instrumentation is disabled
+active = None
+
+
+def enable(clock=None):
+    '''Enables instrumentation and returns the new active instrumentation. Times are taken from clock, which defaults to wall-clock time.'''
+    global active
+    active = Instrumentation(clock)
+    return active
+
+
+def disable():
+    '''Disables instrumentation.'''
+    global active
+    active = None
+
+
+def create_lock(owner, name):
+    '''Creates a lock for owner. If instrumentation is enabled the lock records the time spent waiting for it in a histogram called name.'''
+    if active:
+        return InstrumentedLock(active, owner, name)
+    return threading.Lock()
+
+
+class Histogram:
+    '''Histogram class with power of two buckets. Values are multiplied by scale and rounded down before bucketing, e.g. a scale of 1e6 buckets seconds by microseconds.'''
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+
+    def observe(self, value):
+        '''Adds a value to the histogram.'''
+        bucket = int(value * self.scale).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+
+    def merge(self, other):
+        '''Adds all values of another histogram of the same scale to this histogram.'''
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+            self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+
+
+    def percentile(self, fraction):
+        '''Returns an upper bound of the given percentile, which is the upper edge of the bucket holding it.'''
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((1 << bucket) / self.scale, self.maximum)
+        return self.maximum
+
+
+    def summary(self):
+        '''Returns the count, mean, minimum, maximum, p50 and p99 of the histogram as a dict.'''
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.minimum,
+            'max': self.maximum,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+        }
+
+
+class Instrumentation:
+    '''Instrumentation class collecting counters and histograms per scope. A scope is a string or an object like a bidding manager or resource agent.
+    Task executions are additionally recorded as a timeline, which can be written as a Chrome trace that can be opened with Perfetto.'''
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock else RealTimeClock()
+        self.lock = threading.Lock()
+        self.start_time = self.clock.now()
+        self.scope_labels = {}
+        self.label_counters = {}
+        self.counters = {}
+        self.histograms = {}
+        self.busy_times = {}
+        self.trace_events = []
+        # Instrumented locks keep their waiting times themselves, so acquiring them never takes the instrumentation's lock. They are merged into the histograms by report()
+        self.instrumented_locks = []
+
+
+    def now(self):
+        '''Returns the current time of the instrumentation's clock.'''
+        return self.clock.now()
+
+
+    def label(self, scope):
+        '''Returns a readable and unique label of a scope. Objects are labeled by their class name and a number.'''
+        if isinstance(scope, str):
+            return scope
+        with self.lock:
+            if id(scope) not in self.scope_labels:
+                type_name = type(scope).__name__
+                self.label_counters[type_name] = self.label_counters.get(type_name, 0) + 1
+                # The scope is kept alive so its id is never reused for another object
+                self.scope_labels[id(scope)] = (scope, type_name + ' ' + str(self.label_counters[type_name] - 1))
+            return self.scope_labels[id(scope)][1]
+
+
+    def count(self, scope, name, amount=1):
+        '''Increases the counter name of a scope by amount.'''
+        key = (self.label(scope), name)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def observe(self, scope, name, value, scale=1e6):
+        '''Adds a value to the histogram name of a scope. The default scale buckets durations in seconds by microseconds.'''
+        key = (self.label(scope), name)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(scale)
+            self.histograms[key].observe(value)
+
+
+    def add_lock(self, instrumented_lock):
+        '''Used internally to register an instrumented lock, whose waiting times are reported under its owner's label.'''
+        with self.lock:
+            self.instrumented_locks.append(instrumented_lock)
+
+
+    def task_performed(self, resource_agent, task, start_time, end_time):
+        '''Records that resource_agent performed task from start_time until end_time.'''
+        agent_label = self.label(resource_agent)
+        self.count(agent_label, 'tasks_performed')
+        self.observe(agent_label, 'task_duration', end_time - start_time)
+        with self.lock:
+            self.busy_times[agent_label] = self.busy_times.get(agent_label, 0.0) + end_time - start_time
+            self.trace_events.append((agent_label, task.name, start_time, end_time))
+
+
+    def report(self):
+        '''Returns all collected counters, histogram summaries and the utilization of every resource agent as a dict mapping scope labels to their metrics.'''
+        elapsed_time = self.now() - self.start_time
+        with self.lock:
+            instrumented_locks = list(self.instrumented_locks)
+        # Waiting times of locks are merged per owner and name, e.g. over all shard locks of a resource storage
+        lock_histograms = {}
+        for instrumented_lock in instrumented_locks:
+            key = (instrumented_lock.label, instrumented_lock.name)
+            if key not in lock_histograms:
+                lock_histograms[key] = Histogram(instrumented_lock.waiting_times.scale)
+            with instrumented_lock.lock:
+                lock_histograms[key].merge(instrumented_lock.waiting_times)
+        scopes = {}
+        with self.lock:
+            for (scope_label, name), value in self.counters.items():
+                scopes.setdefault(scope_label, {})[name] = value
+            for key, histogram in self.histograms.items():
+                if key in lock_histograms:
+                    lock_histograms[key].merge(histogram)
+                else:
+                    lock_histograms[key] = histogram
+            for (scope_label, name), histogram in lock_histograms.items():
+                scopes.setdefault(scope_label, {})[name] = histogram.summary()
+            for scope_label, busy_time in self.busy_times.items():
+                scopes.setdefault(scope_label, {})['busy_time'] = busy_time
+                scopes[scope_label]['idle_time'] = max(0.0, elapsed_time - busy_time)
+                scopes[scope_label]['utilization'] = busy_time / elapsed_time if elapsed_time > 0 else 0.0
+        return scopes
+
+
+    def chrome_trace(self):
+        '''Returns the task execution timeline as a Chrome trace event dict with one track per resource agent.'''
+        events = []
+        track_ids = {}
+        with self.lock:
+            for agent_label, task_name, start_time, end_time in self.trace_events:
+                if agent_label not in track_ids:
+                    track_ids[agent_label] = len(track_ids)
+                    events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': track_ids[agent_label], 'args': {'name': agent_label}})
+                events.append({
+                    'name': task_name,
+                    'cat': 'task',
+                    'ph': 'X',
+                    'pid': 0,
+                    'tid': track_ids[agent_label],
+                    'ts': (start_time - self.start_time) * 1e6,
+                    'dur': (end_time - start_time) * 1e6,
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+    def write(self, metrics_path=None, trace_path=None):
+        '''Writes the report as JSON to metrics_path and the Chrome trace to trace_path.'''
+        if metrics_path:
+            with open(metrics_path, 'w', encoding='utf-8') as metrics_file:
+                json.dump(self.report(), metrics_file, indent=4)
+        if trace_path:
+            with open(trace_path, 'w', encoding='utf-8') as trace_file:
+                json.dump(self.chrome_trace(), trace_file)
+
+
+class InstrumentedLock:
+    '''Lock class recording the time spent waiting to acquire it. It can be used wherever a threading.Lock is used, including as the lock of a threading.Condition.
+    Waiting times are recorded in a histogram of the lock itself while holding the lock, so instrumented locks are not serialized behind a shared lock and only contended acquisitions read the clock.'''
+
+    def __init__(self, instrumentation, owner, name):
+        self.lock = threading.Lock()
+        self.instrumentation = instrumentation
+        self.label = instrumentation.label(owner)
+        self.name = name
+        self.waiting_times = Histogram(1e6)
+        instrumentation.add_lock(self)
+
+
+    def acquire(self, blocking=True, timeout=-1):
+        '''Acquires the lock like threading.Lock.acquire() and records the waiting time of blocking acquisitions.'''
+        if not blocking:
+            return self.lock.acquire(False)
+        if self.lock.acquire(False):
+            self.waiting_times.observe(0.0)
+            return True
+        wait_start_time = self.instrumentation.now()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            self.waiting_times.observe(self.instrumentation.now() - wait_start_time)
+        else:
+            # The lock's histogram may only be changed while holding the lock
+            self.instrumentation.observe(self.label, self.name, self.instrumentation.now() - wait_start_time)
+        return acquired
+
+
+    def release(self):
+        '''Releases the lock.'''
+        self.lock.release()
+
+
+    def locked(self):
+        '''Returns true if the lock is acquired.'''
+        return self.lock.locked()
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, *args):
+        self.release()
@@ -1,435 +1,131 @@
-'''The main file of the SFCS simulation suit. This file contains all test scenarios and handles computing mean run times and standard deviations for each scenario'''
-
-import time
-import math
-import matplotlib.pyplot as plt
-
-from resource_storage import ResourceStorage
-from sfcs import ResourceAgent, BiddingManager, RecursiveResourceAgent
-from task import AssembleIronGearWheelTask, AssembleElectronicCircuitTask, AssembleCopperCableTask, AssembleAdvancedCircuitTask
-
-def run_test_0(save_fig):
-    '''Method to run test scenario 0. For more information about the scenario refer to the linked paper in the README.md'''
-    resource_storage = ResourceStorage()
-    resource_storage.resources = {
-        'iron_plate': 200,
-        'copper_plate': 50,
-        'plastic_bar': 0,
-        'iron_gear_wheel': 0,
-        'copper_cable': 0,
-        'electronic_circuit': 0,
-        'advanced_circuit': 0,
-    }
-
-    bm = BiddingManager(resource_storage)
-
-    total_task_time = 0.0
-    num_assemblers = 10
-
-    for _ in range (num_assemblers):
-        r_agent = ResourceAgent(['IGW_Task', 'CC_Task'])
-        r_agent.run()
-        bm.add_manufacturing_resource(r_agent)
-
-    data_iron_plate = []
-    data_copper_plate = []
-    data_iron_gear_wheel = []
-    data_copper_cable = []
-    delta = []
-    run_time = 0
-    goal_accomplished_time = 0
-    start_time = time.perf_counter()
-
-    add_extra_tasks = True
-
-    for _ in range (100):
-        task = AssembleIronGearWheelTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    while goal_accomplished_time == 0 or run_time <= goal_accomplished_time + 2.0:
-        data_iron_plate.append(resource_storage.resources['iron_plate'])
-        data_iron_gear_wheel.append(resource_storage.resources['iron_gear_wheel'])
-        data_copper_plate.append(resource_storage.resources['copper_plate'])
-        data_copper_cable.append(resource_storage.resources['copper_cable'])
-        run_time = time.perf_counter() - start_time
-        delta.append(run_time)
-
-        if resource_storage.resources['iron_gear_wheel'] == 100 and resource_storage.resources['copper_cable'] == 100 and goal_accomplished_time == 0:
-            goal_accomplished_time = run_time
-
-        if add_extra_tasks and run_time > 2.5:
-            for _ in range (50):
-                task = AssembleCopperCableTask(resource_storage)
-                total_task_time += task.time
-                bm.schedule_task(task)
-            add_extra_tasks = False
-
-        time.sleep(0.01)
-
-    resource_storage.stop_resource_access()
-
-    for resource_agent in bm.manufacturing_resources:
-        resource_agent.stop()
-
-    print('Test run 0 took', goal_accomplished_time, 'seconds')
-    print('Optimal run would take', total_task_time / num_assemblers, 'seconds')
-
-    plt.figure()
-
-    plt.plot(delta, data_iron_plate, label='Iron Plate')
-    plt.plot(delta, data_iron_gear_wheel, label='Iron Gear Wheel')
-    plt.plot(delta, data_copper_plate, label='Copper Plate')
-    plt.plot(delta, data_copper_cable, label='Copper Cable')
-    plt.axvline(x=goal_accomplished_time, color=(1.0, 0.0, 0.0), linestyle='--', linewidth=2.0)
-
-    plt.xlabel('Time in s')
-    plt.ylabel('Resources')
-    plt.title('SFCS test run 0')
-    plt.legend()
-
-    if save_fig:
-        plt.savefig('TestRun0.png')
-
-    plt.close()
-    return goal_accomplished_time
-
-
-def run_test_1(save_fig):
-    '''Method to run test scenario 1. For more information about the scenario refer to the linked paper in the README.md'''
-    resource_storage = ResourceStorage()
-    resource_storage.resources = {
-        'iron_plate': 40,
-        'copper_plate': 100,
-        'plastic_bar': 40,
-        'iron_gear_wheel': 0,
-        'copper_cable': 0,
-        'electronic_circuit': 0,
-        'advanced_circuit': 0,
-    }
-
-    bm = BiddingManager(resource_storage)
-
-    total_task_time = 0.0
-    num_assemblers = 10
-
-    for i in range (num_assemblers):
-        r_agent = ResourceAgent(['EC_Task', 'AC_Task', 'CC_Task'])
-        r_agent.run()
-        bm.add_manufacturing_resource(r_agent)
-
-    data_iron_plate = []
-    data_copper_plate = []
-    data_iron_gear_wheel = []
-    data_copper_cable = []
-    data_plastic_bar = []
-    data_electronic_circuit = []
-    data_advanced_circuit = []
-    delta = []
-    run_time = 0
-    goal_accomplished_time = 0
-    start_time = time.perf_counter()
-
-    for _ in range (100):
-        task = AssembleCopperCableTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    for _ in range (40):
-        task = AssembleElectronicCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-    
-    for _ in range (20):
-        task = AssembleAdvancedCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    while goal_accomplished_time == 0 or run_time <= goal_accomplished_time + 2.0:
-        data_iron_plate.append(resource_storage.resources['iron_plate'])
-        data_iron_gear_wheel.append(resource_storage.resources['iron_gear_wheel'])
-        data_copper_plate.append(resource_storage.resources['copper_plate'])
-        data_copper_cable.append(resource_storage.resources['copper_cable'])
-        data_plastic_bar.append(resource_storage.resources['plastic_bar'])
-        data_electronic_circuit.append(resource_storage.resources['electronic_circuit'])
-        data_advanced_circuit.append(resource_storage.resources['advanced_circuit'])
-        run_time = time.perf_counter() - start_time
-        delta.append(run_time)
-
-        if resource_storage.resources['advanced_circuit'] == 20 and goal_accomplished_time == 0:
-            goal_accomplished_time = run_time
-
-        time.sleep(0.01)
-
-    resource_storage.stop_resource_access()
-
-    for resource_agent in bm.manufacturing_resources:
-        resource_agent.stop()
-
-    print('Test run 1 took', goal_accomplished_time, 'seconds')
-    print('Optimal run would take', total_task_time / num_assemblers, 'seconds')
-
-    plt.figure()
-
-    plt.plot(delta, data_iron_plate, label='Iron Plate')
-    plt.plot(delta, data_iron_gear_wheel, label='Iron Gear Wheel')
-    plt.plot(delta, data_copper_plate, label='Copper Plate')
-    plt.plot(delta, data_copper_cable, label='Copper Cable')
-    plt.plot(delta, data_plastic_bar, label='Plastic Bar')
-    plt.plot(delta, data_electronic_circuit, label='Electronic Circuit')
-    plt.plot(delta, data_advanced_circuit, label='Advanced Circuit')
-    plt.axvline(x=goal_accomplished_time, color=(1.0, 0.0, 0.0), linestyle='--', linewidth=2.0)
-
-    plt.xlabel('Time in s')
-    plt.ylabel('Resources')
-    plt.title('SFCS test run 1')
-    plt.legend()
-
-    if save_fig:
-        plt.savefig('TestRun1.png')
-
-    plt.close()
-    return goal_accomplished_time
-
-
-def run_test_2(save_fig):
-    '''Method to run test scenario 2. For more information about the scenario refer to the linked paper in the README.md'''
-    resource_storage = ResourceStorage()
-    resource_storage.resources = {
-        'iron_plate': 40,
-        'copper_plate': 100,
-        'plastic_bar': 40,
-        'iron_gear_wheel': 0,
-        'copper_cable': 0,
-        'electronic_circuit': 0,
-        'advanced_circuit': 0,
-    }
-
-    bm = BiddingManager(resource_storage)
-
-    total_task_time = 0.0
-    num_assemblers = 10
-
-    for i in range (num_assemblers):
-        r_agent = ResourceAgent(['EC_Task', 'AC_Task', 'CC_Task'])
-        r_agent.run()
-        bm.add_manufacturing_resource(r_agent)
-
-    data_iron_plate = []
-    data_copper_plate = []
-    data_iron_gear_wheel = []
-    data_copper_cable = []
-    data_plastic_bar = []
-    data_electronic_circuit = []
-    data_advanced_circuit = []
-    delta = []
-    run_time = 0
-    goal_accomplished_time = 0
-    start_time = time.perf_counter()
-
-    for _ in range (100):
-        task = AssembleCopperCableTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    for _ in range (20):
-        task = AssembleAdvancedCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    for _ in range (40):
-        task = AssembleElectronicCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    while run_time <= total_task_time / num_assemblers * 3.0:
-        data_iron_plate.append(resource_storage.resources['iron_plate'])
-        data_iron_gear_wheel.append(resource_storage.resources['iron_gear_wheel'])
-        data_copper_plate.append(resource_storage.resources['copper_plate'])
-        data_copper_cable.append(resource_storage.resources['copper_cable'])
-        data_plastic_bar.append(resource_storage.resources['plastic_bar'])
-        data_electronic_circuit.append(resource_storage.resources['electronic_circuit'])
-        data_advanced_circuit.append(resource_storage.resources['advanced_circuit'])
-        run_time = time.perf_counter() - start_time
-        delta.append(run_time)
-
-        if resource_storage.resources['advanced_circuit'] == 20 and goal_accomplished_time == 0:
-            goal_accomplished_time = run_time
-
-        time.sleep(0.01)
-
-    resource_storage.stop_resource_access()
-
-    for resource_agent in bm.manufacturing_resources:
-        resource_agent.stop()
-
-    print('Test run 2 took', goal_accomplished_time, 'seconds')
-    print('Optimal run would take', total_task_time / num_assemblers, 'seconds')
-
-    plt.figure()
-
-    plt.plot(delta, data_iron_plate, label='Iron Plate')
-    plt.plot(delta, data_iron_gear_wheel, label='Iron Gear Wheel')
-    plt.plot(delta, data_copper_plate, label='Copper Plate')
-    plt.plot(delta, data_copper_cable, label='Copper Cable')
-    plt.plot(delta, data_plastic_bar, label='Plastic Bar')
-    plt.plot(delta, data_electronic_circuit, label='Electronic Circuit')
-    plt.plot(delta, data_advanced_circuit, label='Advanced Circuit')
-
-    plt.xlabel('Time in s')
-    plt.ylabel('Resources')
-    plt.title('SFCS test run 2')
-    plt.legend()
-
-    if save_fig:
-        plt.savefig('TestRun2.png')
-
-    plt.close()
-    return goal_accomplished_time
-
-
-def run_test_3(save_fig):
-    '''Method to run test scenario 3. For more information about the scenario refer to the linked paper in the README.md'''
-    resource_storage = ResourceStorage()
-    resource_storage.resources = {
-        'iron_plate': 40,
-        'copper_plate': 100,
-        'plastic_bar': 40,
-        'iron_gear_wheel': 0,
-        'copper_cable': 0,
-        'electronic_circuit': 0,
-        'advanced_circuit': 0,
-    }
-
-    bm = BiddingManager(resource_storage)
-    sub_bm = BiddingManager(resource_storage)
-
-    total_task_time = 0.0
-    num_assemblers = 20
-
-    for i in range (19):
-        r_agent = ResourceAgent(['EC_Task', 'AC_Task'])
-        r_agent.run()
-        bm.add_manufacturing_resource(r_agent)
-
-    for i in range (1):
-        r_agent = ResourceAgent(['CC_Task'])
-        r_agent.run()
-        sub_bm.add_manufacturing_resource(r_agent)
-
-    rec_r_agent = RecursiveResourceAgent(sub_bm, ['CC_Task'])
-    rec_r_agent.run()
-    bm.add_manufacturing_resource(rec_r_agent)
-
-    data_iron_plate = []
-    data_copper_plate = []
-    data_iron_gear_wheel = []
-    data_copper_cable = []
-    data_plastic_bar = []
-    data_electronic_circuit = []
-    data_advanced_circuit = []
-    delta = []
-    run_time = 0
-    goal_accomplished_time = 0
-    start_time = time.perf_counter()
-
-    for _ in range (100):
-        task = AssembleCopperCableTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    for _ in range (40):
-        task = AssembleElectronicCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-    
-    for _ in range (20):
-        task = AssembleAdvancedCircuitTask(resource_storage)
-        total_task_time += task.time
-        bm.schedule_task(task)
-
-    while goal_accomplished_time == 0 or run_time <= goal_accomplished_time + 2.0:
-        data_iron_plate.append(resource_storage.resources['iron_plate'])
-        data_iron_gear_wheel.append(resource_storage.resources['iron_gear_wheel'])
-        data_copper_plate.append(resource_storage.resources['copper_plate'])
-        data_copper_cable.append(resource_storage.resources['copper_cable'])
-        data_plastic_bar.append(resource_storage.resources['plastic_bar'])
-        data_electronic_circuit.append(resource_storage.resources['electronic_circuit'])
-        data_advanced_circuit.append(resource_storage.resources['advanced_circuit'])
-        run_time = time.perf_counter() - start_time
-        delta.append(run_time)
-
-        if resource_storage.resources['advanced_circuit'] == 20 and goal_accomplished_time == 0:
-            goal_accomplished_time = run_time
-
-        time.sleep(0.01)
-
-    resource_storage.stop_resource_access()
-
-    for resource_agent in bm.manufacturing_resources:
-        resource_agent.stop()
-
-    for resource_agent in sub_bm.manufacturing_resources:
-        resource_agent.stop()
-
-    print('Test run 3 took', goal_accomplished_time, 'seconds')
-    print('Optimal run would take', total_task_time / num_assemblers, 'seconds')
-
-    plt.figure()
-
-    plt.plot(delta, data_iron_plate, label='Iron Plate')
-    plt.plot(delta, data_iron_gear_wheel, label='Iron Gear Wheel')
-    plt.plot(delta, data_copper_plate, label='Copper Plate')
-    plt.plot(delta, data_copper_cable, label='Copper Cable')
-    plt.plot(delta, data_plastic_bar, label='Plastic Bar')
-    plt.plot(delta, data_electronic_circuit, label='Electronic Circuit')
-    plt.plot(delta, data_advanced_circuit, label='Advanced Circuit')
-    plt.axvline(x=goal_accomplished_time, color=(1.0, 0.0, 0.0), linestyle='--', linewidth=2.0)
-
-    plt.xlabel('Time in s')
-    plt.ylabel('Resources')
-    plt.title('SFCS test run 3')
-    plt.legend()
-
-    if save_fig:
-        plt.savefig('TestRun3.png')
-
-    plt.close()
-    return goal_accomplished_time
+'''The main file of the SFCS simulation suit. This file runs the test scenarios defined by the scenario files in the scenarios directory and handles computing mean run times, standard deviations, confidence intervals and percentiles for each scenario'''
+
+import argparse
+import concurrent.futures
+import os
+import random
+
+from scenario import load_scenario, run_scenario
+from study_statistics import PERCENTILES, RunningStatistics
+
+SCENARIOS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios', 'test_run_' + str(i) + '.json') for i in range(4)]
+
+
+def run_replication(scenario_path, iteration, simulated, seed, instrumentation_directory=None, plot=True, event_log_directory=None):
+    '''Runs one replication of a test scenario and returns its goal time. Each replication creates its own resource storage and bidding managers, so replications may run in separate processes.
+    The random number generator is seeded per replication and if plot is true the plot is only saved for the first iteration.
+    If an instrumentation directory is given, the replication's metrics and Chrome trace are written to it. If an event log directory is given, the replication's event log is written to it.'''
+    random.seed(seed)
+    replication_name = os.path.splitext(os.path.basename(scenario_path))[0] + '_' + str(iteration)
+    instrumentation_prefix = None
+    if instrumentation_directory:
+        instrumentation_prefix = os.path.join(instrumentation_directory, replication_name)
+    event_log_path = None
+    if event_log_directory:
+        event_log_path = os.path.join(event_log_directory, replication_name + '.events')
+    return run_scenario(load_scenario(scenario_path), plot and iteration == 0, simulated, instrumentation_prefix, event_log_path)
+
+
+def replication_seed(base_seed, num_scenarios, scenario_index, iteration):
+    '''Returns the seed of a replication. It only depends on the replication itself, so serial and parallel runs use the same seeds.'''
+    return base_seed + iteration * num_scenarios + scenario_index
+
+
+def study_finished(scenario_statistics, args):
+    '''Returns true if no more replications of a scenario are needed, because all runs were performed or the confidence interval of its mean is narrow enough.'''
+    if scenario_statistics.count >= args.runs:
+        return True
+    return args.ci_half_width is not None and scenario_statistics.precise_enough(args.ci_half_width, args.min_runs)
+
+
+def run_parallel_study(args, statistics):
+    '''Runs the replications of all scenarios in worker processes and adds their goal times to statistics.
+    Goal times are added in iteration order, so a study stops after the same replications as a serial one. Replications started after their scenario's study finished are discarded.'''
+    num_scenarios = len(args.scenarios)
+    next_iterations = [0] * num_scenarios
+    active_scenarios = list(range(num_scenarios))
+    # Maps the futures of running replications to their scenario index and iteration
+    pending_futures = {}
+    # Goal times of finished replications per scenario, mapped by iteration, until all earlier replications of the scenario finished
+    reorder_buffers = [{} for _ in range(num_scenarios)]
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        while active_scenarios:
+            # Keeping every worker busy with the next replications of the active scenarios
+            submitted = True
+            while submitted and len(pending_futures) < args.workers:
+                submitted = False
+                for scenario_index in active_scenarios:
+                    i = next_iterations[scenario_index]
+                    if len(pending_futures) < args.workers and i < args.runs:
+                        seed = replication_seed(args.seed, num_scenarios, scenario_index, i)
+                        future = executor.submit(run_replication, args.scenarios[scenario_index], i, args.simulate, seed, args.instrument, args.plot, args.event_log)
+                        pending_futures[future] = (scenario_index, i)
+                        next_iterations[scenario_index] += 1
+                        submitted = True
+            finished_futures, _ = concurrent.futures.wait(pending_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished_futures:
+                scenario_index, i = pending_futures.pop(future)
+                if scenario_index in active_scenarios:
+                    reorder_buffers[scenario_index][i] = future.result()
+            for scenario_index in list(active_scenarios):
+                scenario_statistics = statistics[scenario_index]
+                reorder_buffer = reorder_buffers[scenario_index]
+                # The study may finish after any replication, so further goal times are only added while it is unfinished
+                while scenario_statistics.count in reorder_buffer and not study_finished(scenario_statistics, args):
+                    scenario_statistics.add(reorder_buffer.pop(scenario_statistics.count))
+                if study_finished(scenario_statistics, args):
+                    active_scenarios.remove(scenario_index)
+                    reorder_buffer.clear()
+                    # Replications which already run keep their worker until they finish and are discarded then
+                    for future in [future for future, key in pending_futures.items() if key[0] == scenario_index]:
+                        if future.cancel():
+                            del pending_futures[future]
 
 
 def main():
     '''Main method. Run this to perform simulations'''
-    num_runs = 30 # Change this to perform a different amount of iterations. Note that one iteration takes more than two minutes
-
-    total_time_test = [[], [], [], []]
-
-    # Testing each scenario in num_runs iterations and collecting the times to achieve a predefined manufacturing goal
-    for i in range(num_runs):
-        print("----")
-        print("Test Iteration", i)
-        total_time_test[0].append(run_test_0(i == 0))
-        total_time_test[1].append(run_test_1(i == 0))
-        total_time_test[2].append(run_test_2(i == 0))
-        total_time_test[3].append(run_test_3(i == 0))
-        print("----")
-
-    # Calculating the mean time and standard deviation for each test scenario
-    for i in range(4):
-        mean = 0.0
-
-        for j in range(num_runs):
-            mean += total_time_test[i][j]
-        mean /= num_runs
-
-        sd = 0.0
-        for j in range(num_runs):
-            sd += pow(total_time_test[i][j] - mean, 2.0)
-        sd /= num_runs
-        sd = math.sqrt(sd)
-
-        print("Test", i, "mean is:", mean)
-        print("Test", i, "sd is:", sd)
+    parser = argparse.ArgumentParser(description='Runs all SFCS test scenarios and prints the mean time, standard deviation, 95% confidence interval and percentiles of each scenario.')
+    parser.add_argument('scenarios', nargs='*', default=SCENARIOS, help='scenario files to run. Defaults to the four test scenarios')
+    parser.add_argument('--simulate', action='store_true', help='run the scenarios as discrete-event simulations on a virtual clock instead of in wall-clock time')
+    parser.add_argument('--runs', type=int, default=30, help='number of iterations per scenario, or the maximum number with --ci-half-width. Note that one iteration takes more than two minutes in wall-clock time')
+    parser.add_argument('--ci-half-width', type=float, metavar='SECONDS', help='stop the iterations of a scenario once the 95%% confidence interval of its mean is at most SECONDS wide on each side')
+    parser.add_argument('--min-runs', type=int, default=3, help='number of iterations per scenario before --ci-half-width may stop it')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes running replications in parallel')
+    parser.add_argument('--seed', type=int, default=0, help='base seed from which the seed of each replication is derived')
+    parser.add_argument('--instrument', metavar='DIRECTORY', help='instrument every replication and write its metrics and Chrome trace to DIRECTORY')
+    parser.add_argument('--event-log', metavar='DIRECTORY', help='write the event log of every replication to DIRECTORY. Logs can be replayed with replay.py')
+    parser.add_argument('--no-plot', dest='plot', action='store_false', help='do not plot the scenarios. Matplotlib is then never imported')
+    args = parser.parse_args()
+
+    for directory in (args.instrument, args.event_log):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # Testing each scenario in up to args.runs iterations and collecting the times to achieve a predefined manufacturing goal
+    statistics = [RunningStatistics() for _ in args.scenarios]
+    if args.workers > 1:
+        run_parallel_study(args, statistics)
+    else:
+        active_scenarios = list(range(len(args.scenarios)))
+        for i in range(args.runs):
+            if not active_scenarios:
+                break
+            print("----")
+            print("Test Iteration", i)
+            for scenario_index in active_scenarios:
+                seed = replication_seed(args.seed, len(args.scenarios), scenario_index, i)
+                statistics[scenario_index].add(run_replication(args.scenarios[scenario_index], i, args.simulate, seed, args.instrument, args.plot, args.event_log))
+            print("----")
+            active_scenarios = [scenario_index for scenario_index in active_scenarios if not study_finished(statistics[scenario_index], args)]
+
+    # Printing the statistics for each test scenario
+    for i, scenario_statistics in enumerate(statistics):
+        lower, upper = scenario_statistics.confidence_interval()
+        print("Test", i, "mean is:", scenario_statistics.mean)
+        print("Test", i, "sd is:", scenario_statistics.standard_deviation(ddof=0))
+        print("Test", i, "95% confidence interval is:", lower, "to", upper)
+        print("Test", i, "percentiles are:", ", ".join(str(percent) + "%: " + str(scenario_statistics.percentile(percent)) for percent in PERCENTILES))
+        print("Test", i, "replications:", scenario_statistics.count)
 
 
 if __name__ == '__main__':
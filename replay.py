@@ -0,0 +1,164 @@
+'''The replay module rebuilds a run from its event log. Replaying only processes the logged events, so it takes a fraction of the run's time.
+The rebuilt run provides the recorded resources, which can be plotted like a live run, and metrics of all agents and tasks, including the lateness of every task with a deadline.
+The logged task arrivals can also be run again as a simulation under a different bid strategy to compare strategies on exactly the same workload.
+Run python3 replay.py --help for all options.'''
+
+import argparse
+import copy
+import json
+
+import event_log
+from scenario import plot_scenario, run_scenario
+from telemetry import ResourceRecorder
+
+
+class ReplayStorage:
+    '''Resource storage class holding the resource amounts of a replayed run. It offers the snapshot() method of a resource storage, so a resource recorder can sample it.'''
+
+    def __init__(self, resources):
+        self.resources = dict(resources)
+        self.version = 0
+
+
+    def change_resource(self, resource_name, amount):
+        '''Sets the amount of resource_name.'''
+        self.resources[resource_name] = amount
+        self.version += 1
+
+
+    def snapshot(self):
+        return self.version, dict(self.resources)
+
+
+def goal_accomplished(resources, goal):
+    '''Returns true if resources hold at least the amounts of resources given by goal.'''
+    for resource_name, amount in goal.items():
+        if resources.get(resource_name, 0) < amount:
+            return False
+    return True
+
+
+def rebuild(scenario, records):
+    '''Rebuilds a logged run. Returns a resource recorder holding the amounts of the scenario's plotted resources after every change and a dict of metrics.'''
+    records = sorted(records, key=lambda record: record[1])
+    storage = ReplayStorage(scenario['resources'])
+    num_storage_changes = sum(1 for record in records if record[0] == event_log.STORAGE_CHANGE)
+    recorder = ResourceRecorder(storage, scenario['plot'], num_storage_changes + 1)
+    recorder.sample(0.0)
+
+    metrics = {'num_events': len(records), 'goal_accomplished_time': None, 'goal_reached_time': None, 'makespan': 0.0, 'resource_agents': {}, 'bidding_managers': {}}
+    arrival_times = {}
+    deadlines = {}
+    award_times = {}
+    start_times = {}
+    finish_times = {}
+    for position, (record_type, record_time, first, second, value) in enumerate(records):
+        if record_type == event_log.STORAGE_CHANGE:
+            storage.change_resource(first, value)
+            # Changes at the same time are sampled once, after the last of them
+            if position + 1 == len(records) or records[position + 1][1] != record_time or records[position + 1][0] != event_log.STORAGE_CHANGE:
+                recorder.sample(record_time)
+                if metrics['goal_reached_time'] is None and goal_accomplished(storage.resources, scenario['goal']):
+                    metrics['goal_reached_time'] = record_time
+        elif record_type == event_log.ARRIVAL:
+            arrival_times[first] = record_time
+        elif record_type == event_log.DEADLINE:
+            deadlines[first] = value
+        elif record_type == event_log.NEGOTIATION:
+            bidding_manager_metrics = metrics['bidding_managers'].setdefault(first, {'negotiations': 0, 'candidates': 0})
+            bidding_manager_metrics['negotiations'] += 1
+            bidding_manager_metrics['candidates'] += value
+        elif record_type == event_log.AWARD:
+            # Tasks delegated to a recursive resource agent are awarded again by its bidding manager and chunks of a batched task are named after it, the first award counts
+            award_times.setdefault(first.split('/', 1)[0], record_time)
+        elif record_type == event_log.TASK_START:
+            start_times[(first, second)] = record_time
+        elif record_type == event_log.TASK_FINISH:
+            agent_metrics = metrics['resource_agents'].setdefault(second, {'tasks_performed': 0, 'busy_time': 0.0})
+            agent_metrics['tasks_performed'] += 1
+            agent_metrics['busy_time'] += record_time - start_times.pop((first, second), record_time)
+            metrics['makespan'] = max(metrics['makespan'], record_time)
+            # A recursive resource agent finishes a task once it delegated it, the last finish of the task or its chunks counts
+            finish_times[first.split('/', 1)[0]] = record_time
+        elif record_type == event_log.GOAL_ACCOMPLISHED:
+            metrics['goal_accomplished_time'] = value
+
+    for agent_metrics in metrics['resource_agents'].values():
+        agent_metrics['utilization'] = agent_metrics['busy_time'] / metrics['makespan'] if metrics['makespan'] > 0 else 0.0
+    for bidding_manager_metrics in metrics['bidding_managers'].values():
+        bidding_manager_metrics['mean_candidates'] = bidding_manager_metrics.pop('candidates') / bidding_manager_metrics['negotiations']
+    award_latencies = [award_times[task] - arrival_times[task] for task in award_times if task in arrival_times]
+    flow_times = [finish_times[task] - arrival_times[task] for task in finish_times if task in arrival_times]
+    metrics['mean_award_latency'] = sum(award_latencies) / len(award_latencies) if award_latencies else 0.0
+    metrics['mean_flow_time'] = sum(flow_times) / len(flow_times) if flow_times else 0.0
+    # Lateness is negative for tasks completed before their deadline. Tasks which were never completed are missing
+    metrics['task_lateness'] = {task: finish_times[task] - deadline for task, deadline in deadlines.items() if task in finish_times}
+    lateness = list(metrics['task_lateness'].values())
+    metrics['mean_lateness'] = sum(lateness) / len(lateness) if lateness else 0.0
+    metrics['max_lateness'] = max(lateness) if lateness else 0.0
+    metrics['num_deadlines'] = len(deadlines)
+    metrics['deadlines_missed'] = sum(1 for task_lateness in lateness if task_lateness > 0) + sum(1 for task in deadlines if task not in finish_times)
+    recorder.close()
+    return recorder, metrics
+
+
+def rerun(scenario, records, bid_strategy, event_log_path=None):
+    '''Runs the logged task arrivals again as a simulation in which every bidding manager uses the named bid strategy. Returns the goal time of the new run.
+    If an event log path is given the new run is logged as well.'''
+    scenario = copy.deepcopy(scenario)
+    # Consecutive arrivals of the same task type, quantity, priority and deadline at the same time were scheduled together, so they are injected together again
+    records = sorted(records, key=lambda record: record[1])
+    priorities = {record[2]: record[4] for record in records if record[0] == event_log.PRIORITY}
+    deadlines = {record[2]: record[4] for record in records if record[0] == event_log.DEADLINE}
+    scenario['tasks'] = []
+    for record in records:
+        if record[0] != event_log.ARRIVAL:
+            continue
+        task_injections = scenario['tasks']
+        task_injection = {'time': record[1], 'task': record[3], 'count': 1, 'quantity': int(record[4])}
+        if record[2] in priorities:
+            task_injection['priority'] = priorities[record[2]]
+        if record[2] in deadlines:
+            task_injection['deadline'] = deadlines[record[2]] - record[1]
+        if task_injections and dict(task_injections[-1], count=1) == task_injection:
+            task_injections[-1]['count'] += 1
+        else:
+            task_injections.append(task_injection)
+    definitions = [scenario['bidding_manager']]
+    while definitions:
+        definition = definitions.pop()
+        definition['bid_strategy'] = bid_strategy
+        definitions.extend(agent_group['bidding_manager'] for agent_group in definition['agents'] if 'bidding_manager' in agent_group)
+    return run_scenario(scenario, False, True, event_log_path=event_log_path)
+
+
+def main():
+    '''Main method. Replays an event log and prints its metrics.'''
+    parser = argparse.ArgumentParser(description='Rebuilds a run from its event log, plots it and computes its metrics.')
+    parser.add_argument('log', help='event log written by main.py --event-log')
+    parser.add_argument('--plot', metavar='FILE', help='file the plot of the rebuilt run is saved to')
+    parser.add_argument('--metrics', metavar='FILE', help='file the metrics are written to as JSON')
+    parser.add_argument('--rerun', metavar='BID_STRATEGY', help='simulate the logged task arrivals again with this bid strategy, e.g. completion_time')
+    parser.add_argument('--rerun-log', metavar='FILE', help='event log of the rerun')
+    args = parser.parse_args()
+
+    scenario, records = event_log.read(args.log)
+    recorder, metrics = rebuild(scenario, records)
+    if args.plot:
+        goal_time = metrics['goal_accomplished_time'] or 0
+        plot_scenario(dict(scenario, figure=args.plot), recorder, goal_time)
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as metrics_file:
+            json.dump(metrics, metrics_file, indent=4)
+    print(scenario['name'], 'took', metrics['goal_accomplished_time'], 'seconds, the goal was reached after', metrics['goal_reached_time'], 'seconds')
+    print('Makespan', metrics['makespan'], 'seconds, mean flow time', metrics['mean_flow_time'], 'seconds, mean award latency', metrics['mean_award_latency'], 'seconds')
+    if metrics['num_deadlines']:
+        print('Deadlines missed', metrics['deadlines_missed'], 'of', metrics['num_deadlines'], 'times, mean lateness', metrics['mean_lateness'], 'seconds, max lateness', metrics['max_lateness'], 'seconds')
+
+    if args.rerun:
+        goal_time = rerun(scenario, records, args.rerun, args.rerun_log)
+        print('Rerun with bid strategy', args.rerun, 'took', goal_time, 'seconds')
+
+
+if __name__ == '__main__':
+    main()
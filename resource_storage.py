@@ -1,36 +1,194 @@
 '''The resource storage module defines a globally accessible resource storage for a SFCS to use.'''
 
+import heapq
+import itertools
 import threading
 import time
 
+import event_log
+import instrumentation
+
+
+# Number of times snapshot() retries copying the resources before it locks all shards
+SNAPSHOT_RETRIES = 100
+
 
 class ResourceStorage:
-    '''Class representing global manufacturing resource storage.'''
+    '''Class representing global manufacturing resource storage.
+    Resources are distributed over shards with one lock each, so consumers and producers of independent resources do not contend for the same lock.'''
 
-    def __init__(self):
+    def __init__(self, num_shards=16):
         self.resources = {}
-        self.resource_access_lock = threading.Lock()
+        self.num_shards = num_shards
+        self.shard_locks = [instrumentation.create_lock(self, 'resource_access_lock_wait') for _ in range(num_shards)]
+        # A shard's version is incremented before and after each change of its resources, so it is odd while the shard is changed
+        self.shard_versions = [0] * num_shards
+        # Events of threads waiting in pop_resources() for resources of a shard. A waiter is held at most once per shard
+        self.shard_waiters = [set() for _ in range(num_shards)]
         self.stop_access = False
+        # Maps ids of pending resource requests to their resources and callbacks. Ids increase in the order requests were made
+        self.resource_requests = {}
+        # Maps resource names to dicts mapping amounts to heaps of the ids of the pending requests waiting for that amount of the resource. Each request waits for the first resource it lacks
+        self.blocked_resource_requests = {}
+        self.resource_request_ids = itertools.count()
+        self.resource_requests_lock = threading.Lock()
+        self.latest_snapshot = (-1, {})
+
+
+    def get_shards(self, resource_names):
+        '''Used internally to return the sorted indices of the shards holding resource_names. Shard locks are always acquired in this order to avoid deadlocks.'''
+        return sorted({hash(resource_name) % self.num_shards for resource_name in resource_names})
+
+
+    def lock_shards(self, shards):
+        '''Used internally to acquire the locks of a sorted list of shards.'''
+        for shard in shards:
+            self.shard_locks[shard].acquire()
+
+
+    def unlock_shards(self, shards):
+        '''Used internally to release the locks of a list of shards.'''
+        for shard in shards:
+            self.shard_locks[shard].release()
+
+
+    def change_resources(self, shards, resources, sign):
+        '''Used internally to add (sign 1) or remove (sign -1) resources. The caller has to hold the locks of their shards.'''
+        for shard in shards:
+            self.shard_versions[shard] += 1
+        for resource_name, amount in resources.items():
+            self.resources[resource_name] += sign * amount
+        if event_log.active:
+            for resource_name in resources:
+                event_log.active.storage_changed(resource_name, self.resources[resource_name])
+        for shard in shards:
+            self.shard_versions[shard] += 1
 
 
     def pop_resource(self, resource_name, amount):
         '''Removes an amount resources of resource_name from the storage.
         Only if the requested amount is available this method returns true.
-        If the requested amount is unavailable the method loops until availability is established again.'''
+        If the requested amount is unavailable the method waits until availability is established again.'''
+        return self.pop_resources({resource_name: amount})
+
+
+    def pop_resources(self, resources):
+        '''Atomically removes a bill of materials from the storage. Resources is a dict mapping resource names to amounts.
+        Either all requested resources are removed at once or none. If they are not all available the method waits until they are and returns true.
+        If resource access is stopped while waiting, nothing is removed and false is returned.'''
+        shards = self.get_shards(resources)
+        waiter = threading.Event()
+        while True:
+            self.lock_shards(shards)
+            try:
+                if self.resources_available(resources):
+                    self.change_resources(shards, resources, -1)
+                    self.remove_waiter(shards, waiter)
+                    return True
+                if self.stop_access:
+                    self.remove_waiter(shards, waiter)
+                    return False
+                # The waiter is registered while holding the shard locks, so no push_resources() call in between can be missed
+                waiter.clear()
+                for shard in shards:
+                    self.shard_waiters[shard].add(waiter)
+            finally:
+                self.unlock_shards(shards)
+            waiter.wait()
+
+
+    def remove_waiter(self, shards, waiter):
+        '''Used internally to remove the waiter of a pop_resources() call from the shards it may still be registered at, after a push to another shard woke it.
+        The caller has to hold the locks of the shards.'''
+        for shard in shards:
+            self.shard_waiters[shard].discard(waiter)
 
-        while not self.resource_available(resource_name, amount):
-            if self.stop_access:
-                return False
-            time.sleep(0.01)
-        with self.resource_access_lock:
-            self.resources[resource_name] -= amount
-            return True
+
+    def request_resources(self, resources, callback):
+        '''Non-blocking counterpart of pop_resources() used in simulation mode.
+        Atomically removes a bill of materials from the storage and calls callback as soon as all requested resources are available.'''
+        shards = self.get_shards(resources)
+        with self.resource_requests_lock:
+            self.lock_shards(shards)
+            try:
+                missing_resource_name = self.missing_resource(resources)
+                if missing_resource_name is not None:
+                    request_id = next(self.resource_request_ids)
+                    self.resource_requests[request_id] = (resources, callback)
+                    self.block_resource_request(request_id, resources, missing_resource_name)
+                    return
+                self.change_resources(shards, resources, -1)
+            finally:
+                self.unlock_shards(shards)
+        callback()
+
+
+    def block_resource_request(self, request_id, resources, missing_resource_name):
+        '''Used internally to let a pending resource request wait for the resource it lacks. The caller has to hold the resource_requests_lock.'''
+        amount = resources[missing_resource_name]
+        heapq.heappush(self.blocked_resource_requests.setdefault(missing_resource_name, {}).setdefault(amount, []), request_id)
+
+
+    def grant_resource_requests(self, resource_names):
+        '''Used internally to grant the pending resource requests waiting for resource_names which can be fulfilled now, in the order they were made.
+        Requests waiting for other resources or for more of a resource than is available still lack it and are not checked. Requests which lack another resource wait for that one instead.
+        Requests waiting for the same amount of a resource are kept in a heap, so granting a request costs O(log n) in the number of pending requests.'''
+        granted_callbacks = []
+        with self.resource_requests_lock:
+            while True:
+                # Find the oldest request waiting for an amount of a pushed resource which is available. Amounts are read without shard locks and checked again below
+                oldest_request = None
+                for resource_name in resource_names:
+                    available_amount = self.resources[resource_name]
+                    for amount, request_ids in self.blocked_resource_requests.get(resource_name, {}).items():
+                        if amount <= available_amount and (oldest_request is None or request_ids[0] < oldest_request[0]):
+                            oldest_request = (request_ids[0], resource_name, amount)
+                if oldest_request is None:
+                    break
+                request_id, resource_name, amount = oldest_request
+                blocked_requests = self.blocked_resource_requests[resource_name]
+                heapq.heappop(blocked_requests[amount])
+                if len(blocked_requests[amount]) == 0:
+                    del blocked_requests[amount]
+
+                resources, callback = self.resource_requests[request_id]
+                shards = self.get_shards(resources)
+                self.lock_shards(shards)
+                try:
+                    missing_resource_name = self.missing_resource(resources)
+                    if missing_resource_name is None:
+                        self.change_resources(shards, resources, -1)
+                        del self.resource_requests[request_id]
+                        granted_callbacks.append(callback)
+                    else:
+                        self.block_resource_request(request_id, resources, missing_resource_name)
+                finally:
+                    self.unlock_shards(shards)
+        for callback in granted_callbacks:
+            callback()
 
 
     def push_resource(self, resource_name, amount):
         '''Adds an amount of resources of resource_name to the storage.'''
-        with self.resource_access_lock:
-            self.resources[resource_name] += amount
+        self.push_resources({resource_name: amount})
+
+
+    def push_resources(self, resources):
+        '''Adds a dict mapping resource names to amounts to the storage and wakes up consumers waiting for them.'''
+        shards = self.get_shards(resources)
+        waiters = []
+        self.lock_shards(shards)
+        try:
+            self.change_resources(shards, resources, 1)
+            for shard in shards:
+                waiters.extend(self.shard_waiters[shard])
+                self.shard_waiters[shard] = set()
+        finally:
+            self.unlock_shards(shards)
+        for waiter in waiters:
+            waiter.set()
+        if len(self.resource_requests) > 0:
+            self.grant_resource_requests(resources)
 
 
     def resource_available(self, resource_name, amount):
@@ -38,6 +196,49 @@ class ResourceStorage:
         return self.resources[resource_name] - amount >= 0
 
 
+    def resources_available(self, resources):
+        '''Returns true if all amounts of a dict mapping resource names to amounts are currently available in storage.'''
+        return self.missing_resource(resources) is None
+
+
+    def missing_resource(self, resources):
+        '''Used internally to return the name of the first resource of a dict mapping resource names to amounts which is not available in its amount, or None if all are.'''
+        for resource_name, amount in resources.items():
+            if not self.resource_available(resource_name, amount):
+                return resource_name
+        return None
+
+
+    def snapshot(self):
+        '''Returns a version and a consistent copy of all resource amounts. The version increases with every change of the storage.
+        Producers and consumers are not blocked, instead the copy is retried if any shard changed while copying. Only after repeated retries all shards are locked.
+        The returned dict is shared between calls while the storage does not change and must not be modified.'''
+        for _ in range(SNAPSHOT_RETRIES):
+            versions = list(self.shard_versions)
+            version = sum(versions) // 2
+            if version == self.latest_snapshot[0]:
+                return self.latest_snapshot
+            if all(shard_version % 2 == 0 for shard_version in versions):
+                resources = dict(self.resources)
+                if versions == self.shard_versions:
+                    self.latest_snapshot = (version, resources)
+                    return self.latest_snapshot
+            time.sleep(0)
+        shards = list(range(self.num_shards))
+        self.lock_shards(shards)
+        try:
+            self.latest_snapshot = (sum(self.shard_versions) // 2, dict(self.resources))
+            return self.latest_snapshot
+        finally:
+            self.unlock_shards(shards)
+
+
     def stop_resource_access(self):
-        '''Method to stop resource access. This is used to halt looping pop_resource() method calls at the end of a simulation.'''
+        '''Method to stop resource access. This is used to halt waiting pop_resource() method calls at the end of a simulation.'''
         self.stop_access = True
+        for shard in range(self.num_shards):
+            with self.shard_locks[shard]:
+                waiters = self.shard_waiters[shard]
+                self.shard_waiters[shard] = set()
+            for waiter in waiters:
+                waiter.set()
@@ -0,0 +1,243 @@
+'''The scenario module runs SFCS test scenarios described by declarative JSON scenario files.
+A scenario file is a JSON object with the following keys:
+name, title and figure: name printed with the results, title of the plot and file name the plot is saved to.
+resources: initial inventory of the resource storage, mapping resource names to amounts.
+bidding_manager: the top level bidding manager. It holds a list of agent groups under agents. Each group creates count resource agents able to perform compatible_tasks.
+    A bidding manager definition may select a bid_strategy by name, either least_loaded, the default, completion_time or deadline, which prefers resource agents able to meet the deadline of a task.
+    Setting work_stealing to true lets idle resource agents of the bidding manager take scheduled tasks from their busier peers.
+    If a bidding manager definition sets hold_back_tasks to true, the bidding manager holds back tasks until their inputs are available and dispatches them in recipe order.
+    A group with a nested bidding_manager creates recursive resource agents, each with its own sub bidding manager built from that definition.
+    Such an agent delegates up to max_delegated_tasks tasks at once, by default as many as its sub bidding manager has resource agents.
+    A group may set task_schedule to select the order its agents perform scheduled tasks in, either fifo, the default, priority, highest priority first, or edf, earliest deadline first.
+    If such a group sets remote to true, each sub bidding manager runs as a holon in its own process instead. A group with an address instead connects to a holon already served at that host:port address, e.g. on another host.
+    Remote holons delegate up to max_delegated_tasks tasks at once and bid with the load of their resource agents like recursive resource agents.
+tasks: list of task injections. Each injection schedules count tasks of the task name task once time seconds have passed since the start of the scenario.
+    An optional quantity makes each task a batched task of that many units, which bidding managers split into chunks across their resource agents.
+    An optional priority, higher is more urgent, and deadline, the number of seconds after the injection the tasks should be completed by, are used by priority and edf task schedules and the deadline bid strategy.
+goal: mapping of resource names to amounts. The goal is accomplished once the storage holds at least these amounts.
+stop: either after_goal, the number of seconds the scenario keeps running after the goal was accomplished, or optimal_time_factor, to stop after that multiple of the optimal run time.
+    An optional max_time stops the scenario after that many seconds in any case, e.g. if the goal cannot be accomplished.
+plot: names of the resources that are recorded and plotted.
+storage_address: optional host:port address the resource storage is served at for remote holons. Defaults to a free local port.
+authkey: optional key authenticating the connections to the resource storage and holons. It is required if the storage or any holon address is not a loopback address.
+    Without it, scenarios connecting to holons at an address use the default key of holons started with transport.py and scenarios only spawning holons use a random key.
+telemetry: optional settings of the resource recorder. capacity is the number of samples held in memory and path the .npy file samples are spilled to for long runs.
+    plot_points optionally limits the number of points plotted per resource, long recordings are downsampled to it before plotting.'''
+
+import json
+
+import event_log
+import instrumentation
+from bid_strategy import BID_STRATEGIES
+from resource_storage import ResourceStorage
+from sfcs import TASK_SCHEDULES, ResourceAgent, BiddingManager, RecursiveResourceAgent
+from simulation import RealTimeClock, Simulation
+from task import RECIPE_GRAPH, TASK_TYPES
+from telemetry import ResourceRecorder, decimate
+from transport import RemoteResourceAgent, StorageServer, choose_authkey, parse_address, spawn_holon
+
+
+# Default number of points plotted per resource
+PLOT_POINTS = 2000
+
+
+def load_scenario(path):
+    '''Loads a scenario definition from a JSON scenario file.'''
+    with open(path, encoding='utf-8') as scenario_file:
+        return json.load(scenario_file)
+
+
+def build_bidding_manager(definition, resource_storage, simulation, bidding_managers, storage_address=None, authkey=None):
+    '''Creates and starts a bidding manager with all resource agents given by a bidding manager definition.
+    Every created bidding manager, including the sub bidding managers of recursive resource agents, is appended to bidding_managers. Bidding managers of remote holons are not.
+    Remote holons access the resource storage served at storage_address and connections to them are authenticated with authkey.'''
+    bid_strategy = BID_STRATEGIES[definition.get('bid_strategy', 'least_loaded')]()
+    recipe_graph = RECIPE_GRAPH if definition.get('hold_back_tasks', False) else None
+    bm = BiddingManager(resource_storage, simulation, bid_strategy, recipe_graph, definition.get('work_stealing', False))
+    bidding_managers.append(bm)
+    for agent_group in definition['agents']:
+        task_schedule_type = TASK_SCHEDULES[agent_group.get('task_schedule', 'fifo')]
+        for _ in range(agent_group.get('count', 1)):
+            if 'address' in agent_group:
+                r_agent = RemoteResourceAgent(parse_address(agent_group['address']), agent_group['compatible_tasks'], authkey, task_schedule_type=task_schedule_type, max_delegated_tasks=agent_group.get('max_delegated_tasks'))
+            elif agent_group.get('remote', False):
+                r_agent = spawn_holon(agent_group['bidding_manager'], agent_group['compatible_tasks'], storage_address, authkey, task_schedule_type, agent_group.get('max_delegated_tasks'))
+            elif 'bidding_manager' in agent_group:
+                sub_bm = build_bidding_manager(agent_group['bidding_manager'], resource_storage, simulation, bidding_managers, storage_address, authkey)
+                r_agent = RecursiveResourceAgent(sub_bm, agent_group['compatible_tasks'], agent_group.get('max_delegated_tasks'), task_schedule_type)
+            else:
+                r_agent = ResourceAgent(agent_group['compatible_tasks'], simulation, task_schedule_type)
+            r_agent.run()
+            bm.add_manufacturing_resource(r_agent)
+    return bm
+
+
+def count_assemblers(definition):
+    '''Returns the number of resource agents performing tasks themselves, i.e. all agents except recursive ones, in a bidding manager definition.
+    The definitions of holons served at an address are unknown, so each of them counts as a single assembler.'''
+    num_assemblers = 0
+    for agent_group in definition['agents']:
+        if 'bidding_manager' in agent_group:
+            num_assemblers += agent_group.get('count', 1) * count_assemblers(agent_group['bidding_manager'])
+        else:
+            num_assemblers += agent_group.get('count', 1)
+    return num_assemblers
+
+
+def uses_remote_holons(definition):
+    '''Returns true if a bidding manager definition contains remote holons.'''
+    for agent_group in definition['agents']:
+        if agent_group.get('remote', False) or 'address' in agent_group:
+            return True
+        if 'bidding_manager' in agent_group and uses_remote_holons(agent_group['bidding_manager']):
+            return True
+    return False
+
+
+def holon_addresses(definition):
+    '''Returns the addresses of all holons a bidding manager definition connects to, which are served on their own.'''
+    addresses = []
+    for agent_group in definition['agents']:
+        if 'address' in agent_group:
+            addresses.append(parse_address(agent_group['address']))
+        elif 'bidding_manager' in agent_group:
+            addresses.extend(holon_addresses(agent_group['bidding_manager']))
+    return addresses
+
+
+def goal_accomplished(resource_storage, goal):
+    '''Returns true if the resource storage holds at least the amounts of resources given by goal.'''
+    _, resources = resource_storage.snapshot()
+    for resource_name, amount in goal.items():
+        if resources[resource_name] < amount:
+            return False
+    return True
+
+
+def plot_scenario(scenario, recorder, goal_accomplished_time):
+    '''Plots the resources recorded by recorder and saves the plot to the scenario's figure file.
+    Matplotlib is only imported here, so runs without plots do not pay for importing it.'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plot_points = scenario.get('telemetry', {}).get('plot_points', PLOT_POINTS)
+    plt.figure()
+
+    times = recorder.times()
+    for resource_name in recorder.resource_names:
+        delta, amounts = decimate(times, recorder.column(resource_name), plot_points)
+        plt.plot(delta, amounts, label=resource_name.replace('_', ' ').title())
+    if goal_accomplished_time != 0:
+        plt.axvline(x=goal_accomplished_time, color=(1.0, 0.0, 0.0), linestyle='--', linewidth=2.0)
+
+    plt.xlabel('Time in s')
+    plt.ylabel('Resources')
+    plt.title(scenario['title'])
+    plt.legend()
+
+    plt.savefig(scenario['figure'])
+    plt.close()
+
+
+def run_scenario(scenario, save_fig, simulated=False, instrumentation_prefix=None, event_log_path=None):
+    '''Runs a scenario definition and returns the time it took to accomplish the scenario's goal, or 0 if the goal was not accomplished.
+    If save_fig is true the recorded resources are plotted and saved to the scenario's figure file.
+    If simulated is true the scenario runs as a discrete-event simulation on a virtual clock.
+    If an instrumentation prefix is given the scenario is instrumented and the metrics and Chrome trace are written to the prefix followed by _metrics.json and _trace.json.
+    If an event log path is given all events of the run are written to an event log at that path, which can be replayed with the replay module.'''
+    simulation = Simulation() if simulated else None
+    clock = simulation if simulated else RealTimeClock()
+    if instrumentation_prefix:
+        instrumentation.enable(clock)
+    resource_storage = ResourceStorage()
+    resource_storage.resources = dict(scenario['resources'])
+
+    storage_server = None
+    authkey = None
+    if uses_remote_holons(scenario['bidding_manager']):
+        if simulated:
+            raise ValueError('Scenarios with remote holons cannot be simulated')
+        storage_address = parse_address(scenario.get('storage_address', 'localhost:0'))
+        addresses = holon_addresses(scenario['bidding_manager'])
+        authkey = choose_authkey(scenario.get('authkey'), [storage_address] + addresses, len(addresses) > 0)
+        storage_server = StorageServer(resource_storage, storage_address, authkey)
+        storage_server.run()
+
+    bidding_managers = []
+    bm = build_bidding_manager(scenario['bidding_manager'], resource_storage, simulation, bidding_managers, storage_server.address if storage_server else None, authkey)
+
+    total_task_time = 0.0
+    num_assemblers = count_assemblers(scenario['bidding_manager'])
+
+    telemetry = scenario.get('telemetry', {})
+    recorder = ResourceRecorder(resource_storage, scenario['plot'], telemetry.get('capacity', 100000), telemetry.get('path'))
+    run_time = 0
+    goal_accomplished_time = 0
+    if event_log_path:
+        event_log.enable(event_log_path, scenario, clock)
+    start_time = clock.now()
+
+    stop = scenario.get('stop', {})
+    pending_task_injections = sorted(scenario['tasks'], key=lambda task_injection: task_injection.get('time', 0.0))
+
+    def inject_tasks(until):
+        nonlocal total_task_time
+        while len(pending_task_injections) > 0 and pending_task_injections[0].get('time', 0.0) <= until:
+            task_injection = pending_task_injections.pop(0)
+            task_type = TASK_TYPES[task_injection['task']]
+            deadline = clock.now() + task_injection['deadline'] if 'deadline' in task_injection else None
+            tasks = [task_type(resource_storage, task_injection.get('quantity', 1), task_injection.get('priority', 0), deadline) for _ in range(task_injection.get('count', 1))]
+            total_task_time += sum(task.duration for task in tasks)
+            if event_log.active:
+                for task in tasks:
+                    event_log.active.arrival(task)
+            bm.schedule_tasks(tasks)
+
+    def scenario_finished():
+        if 'max_time' in stop and run_time > stop['max_time']:
+            return True
+        if 'optimal_time_factor' in stop:
+            return run_time > total_task_time / num_assemblers * stop['optimal_time_factor']
+        return goal_accomplished_time != 0 and run_time > goal_accomplished_time + stop.get('after_goal', 2.0)
+
+    inject_tasks(0.0)
+
+    while not scenario_finished():
+        run_time = clock.now() - start_time
+        recorder.sample(run_time)
+
+        if goal_accomplished_time == 0 and goal_accomplished(resource_storage, scenario['goal']):
+            goal_accomplished_time = run_time
+
+        inject_tasks(run_time)
+
+        clock.sleep(0.01)
+
+    # Resource access is stopped first, as stopping a remote holon waits for its agents, which may wait for resources
+    resource_storage.stop_resource_access()
+    for bidding_manager in bidding_managers:
+        for resource_agent in bidding_manager.manufacturing_resources:
+            resource_agent.stop()
+    # Instrumentation and the event log are process-wide, so agents still performing tasks are waited for before they are disabled. Otherwise their records would end up in the next run's log
+    for bidding_manager in bidding_managers:
+        bidding_manager.join()
+    recorder.close()
+
+    if instrumentation_prefix:
+        instrumentation.active.write(instrumentation_prefix + '_metrics.json', instrumentation_prefix + '_trace.json')
+        instrumentation.disable()
+
+    if storage_server:
+        storage_server.stop()
+    if event_log_path:
+        event_log.active.goal_accomplished(goal_accomplished_time)
+        event_log.disable()
+
+    print(scenario['name'], 'took', goal_accomplished_time, 'seconds')
+    print('Optimal run would take', total_task_time / num_assemblers, 'seconds')
+
+    if save_fig:
+        plot_scenario(scenario, recorder, goal_accomplished_time)
+
+    return goal_accomplished_time
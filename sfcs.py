@@ -1,157 +1,882 @@
 '''The SFCS module defines all classes needed to represent the organizational structure of the proposed SFCS.
 The classes are mostly based on the modules defined by MANPro.'''
 
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import random
 import threading
 import time
 
+import event_log
+import instrumentation
+from bid_strategy import LeastLoadedBidStrategy, LoadBoard
+
+
+# Number of chunks per candidate resource agent a task of a greater quantity is split into when it is awarded
+CHUNKS_PER_AGENT = 4
+
+# Number of bits of the ordinals running sums of task schedules are kept for. Ordinals range from minus to plus half of 2 to the power of this
+ORDINAL_BITS = 48
+
+# Seconds deadlines are rounded down to when summing the times of tasks ahead of a task in earliest deadline first schedules
+DEADLINE_RESOLUTION = 0.001
+
+# Number of randomly chosen peers a resource agent tries to steal a task from, besides the peer which woke it up
+STEAL_SAMPLE_SIZE = 4
+
+logger = logging.getLogger(__name__)
+
+negotiation_executor = None
+negotiation_executor_lock = threading.Lock()
+
+
+def get_negotiation_executor():
+    '''Returns the bounded thread pool shared by all task agents to run their negotiations. The pool is created on first use.'''
+    global negotiation_executor
+    with negotiation_executor_lock:
+        if negotiation_executor is None:
+            negotiation_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='TaskAgent')
+        return negotiation_executor
+
 
 class BiddingManager:
-    '''Bidding Manager class representing a BM as described by MANPro.'''
+    '''Bidding Manager class representing a BM as described by MANPro.
+    If a simulation is given, negotiations are performed on the simulation's virtual clock instead of in separate threads.
+    The bid strategy is used by all negotiations of this bidding manager and defaults to the least loaded strategy given in the paper.
+    If a recipe graph is given, scheduled tasks are held back until their inputs are available and are then dispatched with their inputs already acquired, so resource agents never wait for resources.
+    If work stealing is true, idle resource agents take scheduled tasks they are able to perform from other resource agents of the bidding manager. See WorkStealingGroup.'''
 
-    def __init__(self, resource_storage):
+    def __init__(self, resource_storage, simulation=None, bid_strategy=None, recipe_graph=None, work_stealing=False):
         self.manufacturing_resources = []
         self.manufacturing_resource_availabilities = []
-        self.manufacturing_resource_availabilities_lock = threading.Lock()
+        self.manufacturing_resource_availabilities_lock = instrumentation.create_lock(self, 'manufacturing_resource_availabilities_lock_wait')
+        self.manufacturing_resource_availabilities_condition = threading.Condition(self.manufacturing_resource_availabilities_lock)
+        # Maps task names to the currently available manufacturing resources able to perform them. Dicts keep the order resources became available
+        self.available_manufacturing_resources = {}
         self.resource_storage = resource_storage
+        self.simulation = simulation
+        self.bid_strategy = bid_strategy if bid_strategy else LeastLoadedBidStrategy()
+        # Loads of all manufacturing resources, which they keep up to date for the bid strategy
+        self.load_board = LoadBoard()
+        self.recipe_graph = recipe_graph
+        # Held back tasks whose inputs were acquired, waiting for the dispatcher thread of a threaded bidding manager
+        self.released_tasks = []
+        self.released_tasks_lock = threading.Lock()
+        self.dispatching_released_tasks = False
+        self.dispatcher_thread = None
+        # Futures of the negotiations of threaded task agents which have not completed yet
+        self.negotiations = set()
+        self.negotiations_lock = threading.Lock()
+        self.work_stealing_group = WorkStealingGroup() if work_stealing else None
 
     
     def add_manufacturing_resource(self, manufacturing_resource):
         '''Adds a R-Agent to the bidding manager to manage'''
-        manufacturing_resource.index = len(self.manufacturing_resources)
-        self.manufacturing_resources.append(manufacturing_resource)
-        self.manufacturing_resource_availabilities.append(True)
+        with self.manufacturing_resource_availabilities_lock:
+            manufacturing_resource.index = self.load_board.add(manufacturing_resource.dynamic_load)
+            manufacturing_resource.load_board = self.load_board
+            with manufacturing_resource.task_schedule.lock:
+                manufacturing_resource.publish_load()
+            if self.work_stealing_group:
+                self.work_stealing_group.add(manufacturing_resource)
+                manufacturing_resource.work_stealing_group = self.work_stealing_group
+                # The agent may already be waiting for a task without ever trying to steal one
+                manufacturing_resource.wake_up()
+            self.manufacturing_resources.append(manufacturing_resource)
+            self.manufacturing_resource_availabilities.append(False)
+            self.set_manufacturing_resource_availability(manufacturing_resource.index, True)
 
 
     def set_manufacturing_resource_availability(self, index, value):
-        '''Used internally to specify if a given manufacturing resource is currently available for negotiations.'''
+        '''Used internally to specify if a given manufacturing resource is currently available for negotiations.
+        The caller has to hold the manufacturing_resource_availabilities_lock.'''
+        if self.manufacturing_resource_availabilities[index] == value:
+            return
         self.manufacturing_resource_availabilities[index] = value
+        manufacturing_resource = self.manufacturing_resources[index]
+        for task_name in manufacturing_resource.compatible_tasks:
+            available_manufacturing_resources = self.available_manufacturing_resources.setdefault(task_name, {})
+            if value:
+                available_manufacturing_resources[index] = manufacturing_resource
+            else:
+                del available_manufacturing_resources[index]
+        if value:
+            self.manufacturing_resource_availabilities_condition.notify_all()
 
 
-    def schedule_task(self, task):
+    def schedule_task(self, task, timeout=None):
         '''Schedules a given task to be performed by the bidding manager.
-        The task will be awarded to a resource agent according to the negotiation process described by MANPro.'''
-        candidate_manufacturing_resources = []
-        while len(candidate_manufacturing_resources) == 0:
-            for manufacturing_resource in self.manufacturing_resources:
-                with self.manufacturing_resource_availabilities_lock:
-                    if self.manufacturing_resource_availabilities[manufacturing_resource.index] and task.name in manufacturing_resource.compatible_tasks:
-                        self.set_manufacturing_resource_availability(manufacturing_resource.index, False)
-                        candidate_manufacturing_resources.append(manufacturing_resource)
+        The task will be awarded to a resource agent according to the negotiation process described by MANPro.
+        If no compatible resource agent is available the method waits until one is released. Returns false if none became available within timeout seconds, true otherwise.'''
+        return self.schedule_tasks([task], timeout) == 1
+
+
+    def schedule_tasks(self, tasks, timeout=None):
+        '''Schedules an iterable of tasks to be performed by the bidding manager.
+        Consecutive tasks with the same name are negotiated in one pass by a single task agent, which awards them one after another in their given order.
+        Returns the number of scheduled tasks. Scheduling stops early if no compatible resource agent became available within timeout seconds.
+        If the bidding manager holds back tasks, all tasks are accepted and timeout is ignored. See hold_back_tasks().'''
+        if self.recipe_graph:
+            return self.hold_back_tasks(tasks)
+        return self.dispatch_tasks(tasks, timeout)
+
+
+    def hold_back_tasks(self, tasks):
+        '''Used internally to hold back tasks until their inputs are available. Tasks are reordered by the recipe graph, so producers get their inputs before the tasks consuming their outputs.
+        The inputs of a task are removed from the resource storage as soon as they are available and the task is dispatched to a resource agent afterwards.
+        Tasks whose inputs are available right away are dispatched before this method returns. Returns the number of tasks.'''
+        ready_tasks = []
+        ready_tasks_lock = threading.Lock()
+
+        def release(task):
+            task.inputs_acquired = True
+            with ready_tasks_lock:
+                if ready_tasks is not None:
+                    ready_tasks.append(task)
+                    return
+            self.release_task(task)
+
+        tasks = self.recipe_graph.order(tasks)
+        for task in tasks:
+            if task.inputs_acquired:
+                release(task)
+            else:
+                self.resource_storage.request_resources(task.total_inputs(), lambda task=task: release(task))
+        # Tasks released from now on are dispatched by release_task()
+        with ready_tasks_lock:
+            released_tasks, ready_tasks = ready_tasks, None
+        self.dispatch_tasks(released_tasks)
+        return len(tasks)
+
+
+    def release_task(self, task):
+        '''Used internally to dispatch a held back task once its inputs were removed from the resource storage.
+        The task is released by the thread of a task pushing resources, which must not wait for a negotiation. Threaded bidding managers therefore queue the task for a dispatcher thread,
+        which is started when the first task is queued and ends once the queue is empty, so a bidding manager runs at most one of them.'''
+        if self.simulation:
+            self.dispatch_tasks([task])
+            return
+        with self.released_tasks_lock:
+            self.released_tasks.append(task)
+            if self.dispatching_released_tasks:
+                return
+            self.dispatching_released_tasks = True
+            self.dispatcher_thread = threading.Thread(target=self.dispatch_released_tasks, daemon=True)
+            self.dispatcher_thread.start()
+
+
+    def dispatch_released_tasks(self):
+        '''Used internally by the dispatcher thread to dispatch released tasks until none is left. Tasks released while a negotiation waits are dispatched together, in the order they were released.'''
+        while True:
+            with self.released_tasks_lock:
+                if len(self.released_tasks) == 0:
+                    self.dispatching_released_tasks = False
+                    return
+                tasks, self.released_tasks = self.released_tasks, []
+            self.dispatch_tasks(tasks)
+
+
+    def track_negotiation(self, future):
+        '''Used internally to keep the future of a negotiation running on the negotiation executor until it completed, so join() is able to wait for it.'''
+        with self.negotiations_lock:
+            self.negotiations.add(future)
+        future.add_done_callback(self.negotiation_completed)
+
+
+    def negotiation_completed(self, future):
+        '''Used internally to forget the future of a completed negotiation.'''
+        with self.negotiations_lock:
+            self.negotiations.discard(future)
+
+
+    def join(self):
+        '''Waits until the stopped resource agents of the bidding manager finished the tasks they perform and all its negotiations completed, so none of them acts after a run ended.
+        Sub bidding managers of recursive resource agents have to be joined on their own, after the agents delegating to them.'''
+        for manufacturing_resource in self.manufacturing_resources:
+            manufacturing_resource.join()
+        dispatcher_thread = self.dispatcher_thread
+        if dispatcher_thread is not None:
+            dispatcher_thread.join()
+        with self.negotiations_lock:
+            negotiations = list(self.negotiations)
+        concurrent.futures.wait(negotiations)
+
+
+    def dispatch_tasks(self, tasks, timeout=None):
+        '''Used internally to negotiate tasks with the resource agents. See schedule_tasks().'''
+        num_scheduled_tasks = 0
+        for task_name, task_group in itertools.groupby(tasks, key=lambda task: task.name):
+            candidate_manufacturing_resources = self.acquire_manufacturing_resources(task_name, timeout)
+            if candidate_manufacturing_resources is None:
+                break
+            task_group = list(task_group)
+            t_agent = TaskAgent(self, task_group, candidate_manufacturing_resources)
+            t_agent.run()
+            num_scheduled_tasks += len(task_group)
+        return num_scheduled_tasks
+
+
+    def acquire_manufacturing_resources(self, task_name, timeout=None):
+        '''Used internally to mark all available manufacturing resources compatible with task_name as unavailable and return them as negotiation candidates.
+        If none is available the method waits until one is released. Returns None if none became available within timeout seconds.'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.manufacturing_resource_availabilities_condition:
+            while len(self.available_manufacturing_resources.get(task_name, {})) == 0:
+                # Negotiations complete instantly in simulation mode, so no resource agent would ever become available
+                if self.simulation:
+                    raise ValueError('No resource agent is able to perform task ' + str(task_name))
+                remaining_time = None if deadline is None else deadline - time.monotonic()
+                if remaining_time is not None and remaining_time <= 0:
+                    return None
+                self.manufacturing_resource_availabilities_condition.wait(remaining_time)
+            candidate_manufacturing_resources = list(self.available_manufacturing_resources[task_name].values())
+            for manufacturing_resource in candidate_manufacturing_resources:
+                self.set_manufacturing_resource_availability(manufacturing_resource.index, False)
+            return candidate_manufacturing_resources
+
+
+class TaskSchedule:
+    '''Thread-safe FIFO task schedule of a resource agent.
+    Taking the next task blocks until a task is added or the schedule is closed. The summed time of all scheduled tasks is kept up to date on every change.
+    The owner is the resource agent the schedule belongs to. It is used to attribute lock waits if instrumentation is enabled and publishes its load after every change of the schedule.
+    Schedules taking tasks in another order can be created by inheriting from this class and overriding insert_task(), pop_next_task(), remove_last_task() and time_ahead_of().'''
+    def __init__(self, owner=None):
+        self.tasks = collections.deque()
+        self.owner = owner
+        self.lock = instrumentation.create_lock(owner if owner else self, 'task_schedule_lock_wait')
+        self.task_added_condition = threading.Condition(self.lock)
+        self.closed = False
+        self.interrupted = False
+        self.total_task_time = 0.0
+
+
+    def __len__(self):
+        with self.lock:
+            return len(self.tasks)
+
+
+    def put(self, task):
+        '''Appends a task to the end of the schedule and wakes up a waiting consumer.'''
+        with self.task_added_condition:
+            self.insert_task(task)
+            self.total_task_time += task.duration
+            self.changed()
+            self.task_added_condition.notify()
+
+
+    def get(self, block=True):
+        '''Removes and returns the first task of the schedule.
+        If block is true and the schedule is empty, the method waits until a task is added or it is interrupted. Returns None if the schedule is closed or no task is available.'''
+        with self.task_added_condition:
+            if block:
+                self.task_added_condition.wait_for(lambda: len(self.tasks) > 0 or self.closed or self.interrupted)
+            self.interrupted = False
+            if self.closed or len(self.tasks) == 0:
+                return None
+            task = self.pop_next_task()
+            # Resetting the sum of an empty schedule keeps rounding errors from accumulating
+            self.total_task_time = self.total_task_time - task.duration if len(self.tasks) > 0 else 0.0
+            self.changed()
+            return task
+
+
+    def take(self, max_tasks):
+        '''Removes and returns up to max_tasks tasks from the front of the schedule without waiting.'''
+        with self.lock:
+            tasks = [self.pop_next_task() for _ in range(min(max_tasks, len(self.tasks)))]
+            self.total_task_time = self.total_task_time - sum(task.duration for task in tasks) if len(self.tasks) > 0 else 0.0
+            self.changed()
+            return tasks
+
+
+    def interrupt(self):
+        '''Makes a waiting or the next call of get() return immediately, even if no task is available.'''
+        with self.task_added_condition:
+            self.interrupted = True
+            self.task_added_condition.notify_all()
+
+
+    def steal(self, compatible_tasks):
+        '''Removes and returns the last task of the schedule whose name is in compatible_tasks, or None if there is none.
+        Stealing from the end of the schedule keeps thieves away from the first task, which the owner takes next.'''
+        with self.lock:
+            task = self.remove_last_task(compatible_tasks)
+            if task:
+                self.total_task_time = self.total_task_time - task.duration if len(self.tasks) > 0 else 0.0
+                self.changed()
+            return task
+
+
+    def time_ahead_of(self, task):
+        '''Returns the summed time of the scheduled tasks which would be performed before task if it was added to the schedule.'''
+        return self.total_task_time
+
+
+    def changed(self):
+        '''Used internally to let the owner publish its load after the schedule changed. The caller has to hold the lock.'''
+        if self.owner is not None:
+            self.owner.publish_load()
+
+
+    def insert_task(self, task):
+        '''Used internally to add a task to the schedule. The caller has to hold the lock.'''
+        self.tasks.append(task)
+
+
+    def pop_next_task(self):
+        '''Used internally to remove and return the task performed next. The caller has to hold the lock and the schedule must not be empty.'''
+        return self.tasks.popleft()
+
+
+    def remove_last_task(self, compatible_tasks):
+        '''Used internally to remove and return the task performed last whose name is in compatible_tasks, or None if there is none. The caller has to hold the lock.'''
+        for position in range(len(self.tasks) - 1, -1, -1):
+            task = self.tasks[position]
+            if task.name in compatible_tasks:
+                del self.tasks[position]
+                return task
+        return None
+
+
+    def close(self):
+        '''Closes the schedule. Waiting and future calls of get() return None.'''
+        with self.task_added_condition:
+            self.closed = True
+            self.task_added_condition.notify_all()
+
+
+class RunningSums:
+    '''Sparse Fenwick tree summing task durations by integer ordinals between -2 ** (ORDINAL_BITS - 1) and 2 ** (ORDINAL_BITS - 1), which are clamped to that range.
+    Adding a duration and summing the durations of all ordinals up to an ordinal take O(ORDINAL_BITS) steps, independent of the number of tasks.'''
+    def __init__(self):
+        # Maps tree indices to the partial sums they hold. Only indices touched so far are present
+        self.tree = {}
+
+
+    def index(self, ordinal):
+        '''Used internally to return the tree index of an ordinal. Tree indices start at 1.'''
+        offset = 1 << (ORDINAL_BITS - 1)
+        return min(max(ordinal, -offset), offset - 1) + offset + 1
+
+
+    def add(self, ordinal, duration):
+        '''Adds a duration, which may be negative to remove it again, to an ordinal.'''
+        index = self.index(ordinal)
+        while index <= 1 << ORDINAL_BITS:
+            self.tree[index] = self.tree.get(index, 0.0) + duration
+            index += index & -index
+
+
+    def prefix_sum(self, ordinal):
+        '''Returns the summed durations of all ordinals up to and including ordinal.'''
+        index = self.index(ordinal)
+        prefix_sum = 0.0
+        while index > 0:
+            prefix_sum += self.tree.get(index, 0.0)
+            index -= index & -index
+        return prefix_sum
+
+
+    def clear(self):
+        '''Removes all durations.'''
+        self.tree.clear()
+
+
+class HeapTaskSchedule(TaskSchedule):
+    '''Base class of task schedules backed by a heap, which take the task of the smallest key next. Tasks of equal keys are taken in the order they were added.
+    The times of scheduled tasks are summed by the ordinals of their keys, so the time ahead of a task is found in O(ORDINAL_BITS) steps instead of going over all scheduled tasks.
+    New orders can be created by inheriting from this class and overriding key() and ordinal().'''
+    def __init__(self, owner=None):
+        TaskSchedule.__init__(self, owner)
+        # Heap of key, sequence number and task. Sequence numbers are unique, so tasks are never compared
+        self.tasks = []
+        self.sequence_numbers = itertools.count()
+        # Times of the scheduled tasks of an ordinal. Tasks without ordinal are only part of total_task_time
+        self.ordered_task_times = RunningSums()
+
+
+    def key(self, task):
+        '''Returns the key of a task. Tasks of smaller keys are performed first.'''
+        raise NotImplementedError
+
+
+    def ordinal(self, task):
+        '''Returns an integer approximating the key of a task for summing the times of tasks ahead of it, or None if the task is performed after all tasks with an ordinal.
+        Ordinals must not decrease with keys. Tasks of the same ordinal count as ahead of each other, so a coarse ordinal overestimates the time ahead of a task.'''
+        raise NotImplementedError
+
+
+    def time_ahead_of(self, task):
+        ordinal = self.ordinal(task)
+        with self.lock:
+            if ordinal is None:
+                return self.total_task_time
+            # Rounding errors of the running sums must not make the time negative
+            return max(0.0, self.ordered_task_times.prefix_sum(ordinal))
+
+
+    def insert_task(self, task):
+        heapq.heappush(self.tasks, (self.key(task), next(self.sequence_numbers), task))
+        self.add_task_time(task, task.duration)
+
 
-        t_agent = TaskAgent(self, task, candidate_manufacturing_resources)
-        t_agent.run()
+    def pop_next_task(self):
+        task = heapq.heappop(self.tasks)[2]
+        self.add_task_time(task, -task.duration)
+        return task
+
+
+    def remove_last_task(self, compatible_tasks):
+        entries = [entry for entry in self.tasks if entry[2].name in compatible_tasks]
+        if len(entries) == 0:
+            return None
+        last_entry = max(entries)
+        self.tasks.remove(last_entry)
+        heapq.heapify(self.tasks)
+        self.add_task_time(last_entry[2], -last_entry[2].duration)
+        return last_entry[2]
+
+
+    def add_task_time(self, task, duration):
+        '''Used internally to add the duration of a task to the running sums, or to remove it again with a negative duration. The caller has to hold the lock.'''
+        if len(self.tasks) == 0:
+            # Clearing the sums of an empty schedule keeps rounding errors from accumulating and the tree from growing with every ordinal ever used
+            self.ordered_task_times.clear()
+            return
+        ordinal = self.ordinal(task)
+        if ordinal is not None:
+            self.ordered_task_times.add(ordinal, duration)
+
+
+class PriorityTaskSchedule(HeapTaskSchedule):
+    '''Task schedule performing tasks of higher priorities first and tasks of the same priority in FIFO order.'''
+    def key(self, task):
+        return (-task.priority,)
+
+
+    def ordinal(self, task):
+        # Fractional priorities are rounded up, so tasks of a slightly lower priority count as ahead
+        return -math.ceil(task.priority)
+
+
+class EarliestDeadlineTaskSchedule(HeapTaskSchedule):
+    '''Task schedule performing the task of the earliest deadline first. Tasks without deadline are performed after all tasks with one, and ties are broken by priority.'''
+    def key(self, task):
+        return (math.inf if task.deadline is None else task.deadline, -task.priority)
+
+
+    def ordinal(self, task):
+        # Deadlines are summed at DEADLINE_RESOLUTION, regardless of priorities, and tasks without deadline are performed after all others
+        return None if task.deadline is None else math.floor(task.deadline / DEADLINE_RESOLUTION)
+
+
+# Maps names of task schedule orders to task schedule classes. This is used to select the schedules of resource agents in scenario definitions.
+TASK_SCHEDULES = {
+    'fifo': TaskSchedule,
+    'priority': PriorityTaskSchedule,
+    'edf': EarliestDeadlineTaskSchedule,
+}
+
+
+class WorkStealingGroup:
+    '''Group of the resource agents of a bidding manager with work stealing, which keeps track of the idle agents of the group.
+    Idle agents do not poll their peers. Instead, an agent whose schedule holds tasks it is not about to perform wakes up an idle agent able to perform them, which tries to steal one.
+    This happens when a busy agent is awarded a task and when an agent starts a task while further tasks are scheduled.
+    A woken agent tries the agent which woke it up first and then a random sample of STEAL_SAMPLE_SIZE peers, so stealing never looks at all agents of the group.'''
+    def __init__(self):
+        self.agents = []
+        # Maps task names to the idle agents able to perform them, in the order they became idle
+        self.idle_agents = {}
+        self.lock = threading.Lock()
+
+
+    def add(self, agent):
+        '''Adds a resource agent to the group.'''
+        with self.lock:
+            self.agents.append(agent)
+
+
+    def set_idle(self, agent, idle):
+        '''Marks a resource agent of the group as idle or busy.'''
+        with self.lock:
+            for task_name in agent.compatible_tasks:
+                idle_agents = self.idle_agents.setdefault(task_name, {})
+                if idle:
+                    idle_agents[agent.index] = agent
+                else:
+                    idle_agents.pop(agent.index, None)
+
+
+    def wake_thief(self, victim, task_names):
+        '''Wakes up the idle agent which became idle first of those able to perform any of task_names, so it tries to steal a task from victim. Does nothing if no such agent is idle.'''
+        with self.lock:
+            thief = None
+            for task_name in task_names:
+                idle_agents = self.idle_agents.get(task_name)
+                if idle_agents:
+                    thief = next(iter(idle_agents.values()))
+                    break
+            if thief is None:
+                return
+            for task_name in thief.compatible_tasks:
+                del self.idle_agents[task_name][thief.index]
+            thief.steal_hint = victim
+        thief.wake_up()
+
+
+    def victims(self, thief):
+        '''Returns the peers a thief tries to steal a task from, which are the peer that woke it up followed by a random sample of its peers holding scheduled tasks, busiest first.'''
+        victim = thief.steal_hint
+        thief.steal_hint = None
+        # Schedules are checked without their locks, which may miss a task that was just added but never blocks the peers
+        peers = [peer for peer in random.sample(self.agents, min(STEAL_SAMPLE_SIZE, len(self.agents))) if peer is not thief and peer is not victim and len(peer.task_schedule.tasks) > 0]
+        peers.sort(key=lambda peer: peer.estimated_completion_time(), reverse=True)
+        return peers if victim is None else [victim] + peers
 
 
 class ResourceAgent:
     '''Resource agent class representing a R-Agent as described by MANPro.
-    Compatible tasks is a list of names of tasks this agent is able to perform.'''
-    def __init__(self, compatible_tasks):
-        self.in_negotiation = False
-        self.in_negotiation_lock = threading.Lock()
-        self.task_schedule = []
-        self.task_schedule_lock = threading.Lock()
+    Compatible tasks is a list of names of tasks this agent is able to perform.
+    If a simulation is given, tasks are performed on the simulation's virtual clock instead of in a separate thread.
+    The work stealing group holds the resource agents of the agent's bidding manager if it uses work stealing, otherwise it is None.
+    The task schedule type is the class of the agent's task schedule, which determines the order scheduled tasks are performed in.'''
+    # True for agents whose load depends on other agents, so bid strategies ask them for their load instead of reading it from the load board
+    dynamic_load = False
+
+    def __init__(self, compatible_tasks, simulation=None, task_schedule_type=TaskSchedule):
+        self.task_schedule = task_schedule_type(self)
         self.run_loop = True
         self.index = 0
         self.compatible_tasks = compatible_tasks
+        self.simulation = simulation
+        self.busy = False
+        self.current_task = None
+        self.current_task_start_time = 0.0
+        self.work_stealing_group = None
+        # Peer which woke up this idle agent to steal one of its tasks
+        self.steal_hint = None
+        self.load_board = None
+        # Thread running the update loop of a threaded agent
+        self.thread = None
 
 
     def run_update_loop(self):
         '''Update loop used internally to run an resource agent's logic in another thread.'''
         while self.run_loop:
-            task = None
-            # Look for next task in the task schedule. If a task is found perform that task until completion
-            with self.task_schedule_lock:
-                if len(self.task_schedule) > 0:
-                    task = self.task_schedule[0]
-                    self.task_schedule.pop(0)
-            if task:
-                task.execute()
+            # Wait for the next task in the task schedule and perform that task until completion. Agents with work stealing steal a task if their schedule is empty
+            if self.work_stealing_group is None:
+                task = self.task_schedule.get()
             else:
-                time.sleep(0.001)
+                task = self.task_schedule.get(block=False)
+                if task is None:
+                    # The agent is marked as idle before it tries to steal, so no task added to a peer afterwards is missed. Being woken up interrupts waiting for the own schedule
+                    self.work_stealing_group.set_idle(self, True)
+                    task = self.steal_task()
+                    if task is None:
+                        task = self.task_schedule.get()
+                    self.work_stealing_group.set_idle(self, False)
+            if task:
+                self.set_current_task(task)
+                self.offer_scheduled_tasks()
+                if event_log.active:
+                    event_log.active.task_started(task, self)
+                active_instrumentation = instrumentation.active
+                if active_instrumentation:
+                    start_time = active_instrumentation.now()
+                    self.perform_task(task)
+                    active_instrumentation.task_performed(self, task, start_time, active_instrumentation.now())
+                else:
+                    self.perform_task(task)
+                if event_log.active:
+                    event_log.active.task_finished(task, self)
+                self.set_current_task(None)
+
+
+    def perform_task(self, task):
+        '''Performs a task until completion.'''
+        task.execute()
+
+
+    def steal_task(self):
+        '''Takes a scheduled task this agent is able to perform from one of its peers, see WorkStealingGroup.victims(). Returns None if none of them has such a task.
+        Only the schedule of the peer a task is taken from is locked.'''
+        for victim in self.work_stealing_group.victims(self):
+            task = victim.task_schedule.steal(self.compatible_tasks)
+            if task:
+                if instrumentation.active:
+                    instrumentation.active.count(self, 'tasks_stolen')
+                return task
+        return None
+
+
+    def offer_scheduled_tasks(self):
+        '''Used internally to wake up an idle peer able to steal a scheduled task after the agent started a task, if further tasks are scheduled.'''
+        if self.work_stealing_group is not None and len(self.task_schedule.tasks) > 0:
+            self.work_stealing_group.wake_thief(self, self.compatible_tasks)
+
+
+    def wake_up(self):
+        '''Makes an idle agent check its task schedule and try to steal a task.'''
+        if self.simulation:
+            self.simulation.schedule(0.0, self.simulate_next_task)
+        else:
+            self.task_schedule.interrupt()
+
+
+    def now(self):
+        '''Returns the current time of the agent's clock, which is the simulation's virtual clock in simulation mode.'''
+        return self.simulation.now() if self.simulation else time.perf_counter()
+
+
+    def queue_length(self):
+        '''Returns the number of tasks the agent has yet to start. This is the load the least loaded bid strategy is based on.'''
+        return len(self.task_schedule)
+
+
+    def set_current_task(self, task):
+        '''Used internally to set the task the agent performs, or None once it is completed, and publish the agent's new load.'''
+        with self.task_schedule.lock:
+            if task:
+                self.current_task_start_time = self.now()
+            self.current_task = task
+            self.publish_load()
+
+
+    def publish_load(self):
+        '''Used internally to write the agent's load to the load board of its bidding manager. The caller has to hold the lock of the agent's task schedule.'''
+        if self.load_board is not None:
+            current_task = self.current_task
+            self.load_board.update(self.index, len(self.task_schedule.tasks), self.task_schedule.total_task_time, current_task.duration if current_task else 0.0, self.current_task_start_time)
+
+
+    def estimated_completion_time(self, task=None):
+        '''Returns the estimated time until the agent completed all its tasks. This is the time of all scheduled tasks plus the remaining time of the current task.
+        If a task is given, the estimate is the time until the agent would complete that task if it was added to the schedule.'''
+        if task is None:
+            completion_time = self.task_schedule.total_task_time
+        else:
+            completion_time = self.task_schedule.time_ahead_of(task) + task.duration
+        current_task = self.current_task
+        if current_task:
+            completion_time += max(0.0, current_task.duration - (self.now() - self.current_task_start_time))
+        return completion_time
+
+
+    def simulate_next_task(self):
+        '''Counterpart of run_update_loop() used in simulation mode. Starts the next task in the task schedule if the agent is idle.'''
+        if self.busy or not self.run_loop:
+            return
+        task = self.task_schedule.get(block=False)
+        if not task and self.work_stealing_group is not None:
+            task = self.steal_task()
+        if not task:
+            if self.work_stealing_group is not None:
+                self.work_stealing_group.set_idle(self, True)
+            return
+        if self.work_stealing_group is not None:
+            self.work_stealing_group.set_idle(self, False)
+        self.busy = True
+        self.set_current_task(task)
+        self.offer_scheduled_tasks()
+        if event_log.active:
+            event_log.active.task_started(task, self)
+        self.simulate_task(task, self.finish_simulated_task)
+
+
+    def simulate_task(self, task, on_finished):
+        '''Performs a task in simulation mode and calls on_finished once it is completed.'''
+        task.simulate(self.simulation, on_finished)
+
+
+    def finish_simulated_task(self):
+        '''Used internally in simulation mode to pick up the next task after the current one is completed.'''
+        if instrumentation.active:
+            instrumentation.active.task_performed(self, self.current_task, self.current_task_start_time, self.simulation.now())
+        if event_log.active:
+            event_log.active.task_finished(self.current_task, self)
+        self.set_current_task(None)
+        self.busy = False
+        self.simulate_next_task()
 
 
     def run(self):
         '''Starts the resource agent. After executing this method the agent is able to perform tasks.'''
-        threading.Thread(target=self.run_update_loop).start()
+        if self.simulation:
+            self.simulation.schedule(0.0, self.simulate_next_task)
+        else:
+            self.thread = threading.Thread(target=self.run_update_loop)
+            self.thread.start()
 
 
     def stop(self):
-        '''Stops a resource agent.'''
+        '''Stops a resource agent. A thread waiting for the next task returns immediately.'''
         self.run_loop = False
+        self.task_schedule.close()
+
+
+    def join(self):
+        '''Waits until the thread of a stopped agent finished the task it performs. Returns immediately for agents without thread.'''
+        if self.thread is not None:
+            self.thread.join()
 
 
     def add_task_to_schedule(self, task):
         '''Adds a task to the agent's task schedule. This is used when the agent was awarded a task after negotiation.'''
-        with self.task_schedule_lock:
-            self.task_schedule.append(task)
+        self.task_schedule.put(task)
+        if instrumentation.active:
+            instrumentation.active.observe(self, 'queue_depth', len(self.task_schedule), scale=1)
+        if self.simulation and not self.busy:
+            self.simulation.schedule(0.0, self.simulate_next_task)
+        elif self.work_stealing_group is not None and (self.busy or self.current_task is not None):
+            # The task waits until the agent completed its current task, so an idle peer is woken up to steal it
+            self.work_stealing_group.wake_thief(self, (task.name,))
 
 
 class RecursiveResourceAgent(ResourceAgent):
     '''Recursive resource agent class representing a R-Agent as described by MANPro.
     This type of resource agent is different as it requires a unique bidding manager to simulate a nested holonic organizational structure.
-    Compatible tasks is a list of names of tasks this agent is able to perform.'''
-    def __init__(self, bidding_manager, compatible_tasks):
-        ResourceAgent.__init__(self, compatible_tasks)
+    Compatible tasks is a list of names of tasks this agent is able to perform.
+    The agent runs in simulation mode if its bidding manager does.
+    Tasks are delegated in batches of up to max_delegated_tasks tasks, which default to the number of resource agents of the sub bidding manager, so all of them receive tasks from a single negotiation.
+    The load the agent bids with is the load of its sub bidding manager's resource agents on average, including the tasks the agent has yet to delegate.'''
+    dynamic_load = True
+
+    def __init__(self, bidding_manager, compatible_tasks, max_delegated_tasks=None, task_schedule_type=TaskSchedule):
+        ResourceAgent.__init__(self, compatible_tasks, bidding_manager.simulation, task_schedule_type)
         self.bidding_manager = bidding_manager
+        self.max_delegated_tasks = max_delegated_tasks
 
 
-    def run_update_loop(self):
-        while self.run_loop:
-            task = None
-            # Look for next task in the task schedule. If a task is found perform that task until completion
-            with self.task_schedule_lock:
-                if len(self.task_schedule) > 0:
-                    task = self.task_schedule[0]
-                    self.task_schedule.pop(0)
-            if task:
-                self.bidding_manager.schedule_task(task)
-            else:
-                time.sleep(0.001)
+    def take_delegated_tasks(self, task):
+        '''Used internally to return task together with further scheduled tasks, up to the number of tasks delegated at once.'''
+        max_delegated_tasks = self.max_delegated_tasks if self.max_delegated_tasks else len(self.bidding_manager.manufacturing_resources)
+        return [task] + self.task_schedule.take(max_delegated_tasks - 1)
+
+
+    def perform_task(self, task):
+        '''Delegates a task and further scheduled tasks to the sub bidding manager.'''
+        self.bidding_manager.schedule_tasks(self.take_delegated_tasks(task))
+
+
+    def simulate_task(self, task, on_finished):
+        self.bidding_manager.schedule_tasks(self.take_delegated_tasks(task))
+        on_finished()
+
+
+    def queue_length(self):
+        sub_agents = self.bidding_manager.manufacturing_resources
+        if len(sub_agents) == 0:
+            return len(self.task_schedule)
+        return (len(self.task_schedule) + sum(sub_agent.queue_length() for sub_agent in sub_agents)) / len(sub_agents)
+
+
+    def estimated_completion_time(self, task=None):
+        sub_agents = self.bidding_manager.manufacturing_resources
+        if task is None:
+            completion_time = self.task_schedule.total_task_time
+        else:
+            completion_time = self.task_schedule.time_ahead_of(task)
+        if len(sub_agents) == 0:
+            return completion_time if task is None else completion_time + task.duration
+        # The estimates of the sub agents include the time of the task itself
+        return (completion_time + sum(sub_agent.estimated_completion_time(task) for sub_agent in sub_agents)) / len(sub_agents)
 
 
 class TaskAgent:
-    '''Task Agent class representing a T-Agent as described by MANPro'''
-    def __init__(self, bidding_manager, task, available_resource_agents):
+    '''Task Agent class representing a T-Agent as described by MANPro.
+    A task agent negotiates a list of tasks with the same name over the same available resource agents.
+    Tasks of a quantity greater than one are split into chunks, which are awarded like single tasks, so a large order only creates a few chunks per resource agent.'''
+    def __init__(self, bidding_manager, tasks, available_resource_agents):
         self.bidding_manager = bidding_manager
-        self.task = task
+        self.tasks = tasks
         self.available_resource_agents = available_resource_agents
+        self.n_agent = None
 
 
     def run_update_loop(self):
-        '''Update loop used internally to run an task agent's logic in another thread.'''
-        # Find best available manufacturing resource and award task
-        n_agent = NegotiationAgent(self.task, self.available_resource_agents)
-        best_r_agent = n_agent.get_best_r_agent()
-        best_r_agent.add_task_to_schedule(self.task)
-        for r_agent in self.available_resource_agents:
-            with self.bidding_manager.manufacturing_resource_availabilities_lock:
+        '''Update loop used internally to run an task agent's logic on the shared negotiation executor.'''
+        active_instrumentation = instrumentation.active
+        if active_instrumentation:
+            start_time = active_instrumentation.now()
+        if event_log.active:
+            event_log.active.negotiation(self.bidding_manager, self.tasks[0].name, len(self.available_resource_agents))
+        # Find best available manufacturing resource for each task and award it. The resource agents are released even if a bid or award fails, so later negotiations are able to use them
+        try:
+            for task in self.tasks:
+                for chunk in self.split_task(task):
+                    self.award_task(chunk)
+        finally:
+            self.release_resource_agents()
+        if active_instrumentation:
+            active_instrumentation.observe(self.bidding_manager, 'negotiation_latency', active_instrumentation.now() - start_time)
+            active_instrumentation.count(self.bidding_manager, 'tasks_awarded', len(self.tasks))
+
+
+    def split_task(self, task):
+        '''Splits a task into at most CHUNKS_PER_AGENT chunks per available resource agent.'''
+        if task.quantity == 1:
+            return (task,)
+        return task.split(len(self.available_resource_agents) * CHUNKS_PER_AGENT)
+
+
+    def award_task(self, task):
+        '''Awards a task to the best available resource agent according to the negotiation agent's bids.
+        All tasks of the task agent are negotiated by the same negotiation agent, so its bid strategy can reuse state between awards.'''
+        if self.n_agent is None:
+            self.n_agent = NegotiationAgent(task, self.available_resource_agents, self.bidding_manager.bid_strategy, self.bidding_manager.load_board)
+        self.n_agent.task = task
+        best_r_agent = self.n_agent.get_best_r_agent()
+        if event_log.active:
+            event_log.active.award(task, best_r_agent)
+        best_r_agent.add_task_to_schedule(task)
+
+
+    def release_resource_agents(self):
+        '''Makes the available resource agents available for other negotiations again.'''
+        with self.bidding_manager.manufacturing_resource_availabilities_lock:
+            for r_agent in self.available_resource_agents:
                 self.bidding_manager.set_manufacturing_resource_availability(r_agent.index, True)
 
 
+    def negotiation_done(self, future):
+        '''Used internally to log the error of a negotiation which failed on the negotiation executor, as no caller waits for its result.'''
+        error = future.exception()
+        if error is not None:
+            logger.error('Negotiation of %d %s tasks failed', len(self.tasks), self.tasks[0].name, exc_info=error)
+
+
     def run(self):
-        '''Starts the task agent.'''
-        threading.Thread(target=self.run_update_loop).start()
+        '''Starts the task agent. In simulation mode the negotiation is completed before this method returns and errors are raised to the caller.'''
+        if self.bidding_manager.simulation:
+            self.run_update_loop()
+        else:
+            future = get_negotiation_executor().submit(self.run_update_loop)
+            self.bidding_manager.track_negotiation(future)
+            future.add_done_callback(self.negotiation_done)
 
 
 class NegotiationAgent:
-    '''Negotiation Agent class representing a N-Agent as described by MANPro'''
-    def __init__(self, task, available_r_agents):
+    '''Negotiation Agent class representing a N-Agent as described by MANPro.
+    Bids are generated by a bid strategy, which defaults to the least loaded strategy given in the paper.
+    The load board holds the loads of the available resource agents if they belong to a bidding manager.'''
+    def __init__(self, task, available_r_agents, bid_strategy=None, load_board=None):
         self.task = task
         self.available_r_agents = available_r_agents
+        self.bid_strategy = bid_strategy if bid_strategy else LeastLoadedBidStrategy()
+        self.load_board = load_board
+        # State the bid strategy keeps while this negotiation agent awards tasks
+        self.bid_state = None
 
 
     def generate_bid(self, resource_agent):
-        '''Generates a bid for a given resource agent according to the method given in the paper.'''
-        return 1.0 / (1 + len(resource_agent.task_schedule))
+        '''Generates a bid for a given resource agent according to the bid strategy.'''
+        return self.bid_strategy.generate_bid(self.task, resource_agent)
 
 
     def get_best_r_agent(self):
         '''Returns the best resource agent according to the generated bids. This is used later in the awarding stage by the task agent.'''
-        max_bid = 0
-        best_resource_agent = None
-        for resource_agent in self.available_r_agents:
-            bid = self.generate_bid(resource_agent)
-            if bid > max_bid:
-                max_bid = bid
-                best_resource_agent = resource_agent
-        return best_resource_agent
+        return self.bid_strategy.get_best_r_agent(self)
@@ -0,0 +1,57 @@
+'''The simulation module defines a discrete-event simulation mode for the SFCS.
+Instead of letting agents and tasks run in wall-clock time, a virtual clock is advanced from one event to the next.'''
+
+import heapq
+import itertools
+import time
+
+
+class RealTimeClock:
+    '''Clock class used by scenarios running in wall-clock time. It offers the same interface as the Simulation class.'''
+
+    def now(self):
+        '''Returns the current time in seconds.'''
+        return time.perf_counter()
+
+
+    def sleep(self, duration):
+        '''Blocks the calling thread for duration seconds.'''
+        time.sleep(duration)
+
+
+class Simulation:
+    '''Discrete-event simulation class holding a virtual clock and an event queue.
+    Bidding managers, agents and tasks created with a simulation schedule events on it instead of starting threads and sleeping.'''
+
+    def __init__(self):
+        self.current_time = 0.0
+        self.events = []
+        self.event_counter = itertools.count()
+
+
+    def now(self):
+        '''Returns the current virtual time in seconds.'''
+        return self.current_time
+
+
+    def schedule(self, delay, callback, *args):
+        '''Schedules callback to be called with args after delay seconds of virtual time.
+        Events due at the same point in time are processed in the order they were scheduled.'''
+        heapq.heappush(self.events, (self.current_time + delay, next(self.event_counter), callback, args))
+
+
+    def run(self, until=None):
+        '''Processes events in chronological order until the event queue is empty.
+        If until is given only events due up to that point in virtual time are processed and the clock is advanced to until.'''
+        while len(self.events) > 0 and (until is None or self.events[0][0] <= until):
+            event_time, _, callback, args = heapq.heappop(self.events)
+            self.current_time = event_time
+            callback(*args)
+        if until is not None and until > self.current_time:
+            self.current_time = until
+
+
+    def sleep(self, duration):
+        '''Advances the virtual clock by duration seconds while processing all events due in that interval.
+        This mirrors RealTimeClock.sleep() so monitoring loops can be written once for both modes.'''
+        self.run(self.current_time + duration)
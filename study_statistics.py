@@ -0,0 +1,69 @@
+'''The study statistics module summarizes the goal times of the replications of a scenario while they come in, so a study can stop once the mean is known precisely enough.'''
+
+import math
+
+import numpy as np
+
+
+# Two-sided 95% quantiles of Student's t-distribution for 1 to 30 degrees of freedom. More degrees of freedom use the normal quantile
+T_QUANTILES = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+               2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+               2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+NORMAL_QUANTILE = 1.960
+
+# Percentiles printed for every scenario
+PERCENTILES = (5, 50, 95)
+
+
+class RunningStatistics:
+    '''Statistics class updating mean and variance with every added value using Welford's algorithm, so they are available after every replication without going over all values again.
+    The values themselves are kept as well, because percentiles cannot be updated incrementally. A study holds one value per replication, so they take little memory.'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squared_deviations = 0.0
+        self.values = []
+
+
+    def add(self, value):
+        '''Adds a value and updates the statistics.'''
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squared_deviations += delta * (value - self.mean)
+        self.values.append(value)
+
+
+    def standard_deviation(self, ddof=1):
+        '''Returns the standard deviation of the values. By default it is the sample standard deviation, ddof=0 returns the population standard deviation.'''
+        if self.count <= ddof:
+            return 0.0
+        return math.sqrt(self.squared_deviations / (self.count - ddof))
+
+
+    def confidence_interval_half_width(self):
+        '''Returns the half-width of the 95% confidence interval of the mean. It is infinite for less than two values.'''
+        if self.count < 2:
+            return math.inf
+        degrees_of_freedom = self.count - 1
+        quantile = T_QUANTILES[degrees_of_freedom - 1] if degrees_of_freedom <= len(T_QUANTILES) else NORMAL_QUANTILE
+        return quantile * self.standard_deviation() / math.sqrt(self.count)
+
+
+    def confidence_interval(self):
+        '''Returns the lower and upper bound of the 95% confidence interval of the mean.'''
+        half_width = self.confidence_interval_half_width()
+        return self.mean - half_width, self.mean + half_width
+
+
+    def percentile(self, percent):
+        '''Returns the given percentile of the values, interpolating between them.'''
+        if self.count == 0:
+            return 0.0
+        return float(np.percentile(self.values, percent))
+
+
+    def precise_enough(self, half_width, min_count=2):
+        '''Returns true if at least min_count values were added and the half-width of the 95% confidence interval is at most half_width.'''
+        return self.count >= max(min_count, 2) and self.confidence_interval_half_width() <= half_width
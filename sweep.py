@@ -0,0 +1,159 @@
+'''The sweep module runs a scenario for every point of a grid of parameter values, e.g. to see how the goal time changes with the number of resource agents and the initial inventory.
+A sweep file is a JSON object with the following keys:
+scenario: path of the scenario file the parameters are applied to, relative to the sweep file.
+parameters: mapping of parameter paths to lists of values. A path is a dot separated list of keys and list indices into the scenario definition,
+    e.g. bidding_manager.agents.0.count for the number of resource agents of the first agent group, resources.iron_plate for the initial iron plates,
+    tasks.1.count for the task mix or bidding_manager.bid_strategy for the bid strategy. Values may be any JSON value, e.g. lists of compatible tasks.
+    The sweep runs every combination of values.
+fixed: optional mapping of parameter paths to values set for every point, e.g. stop.max_time to bound points whose goal cannot be accomplished.
+runs: optional number of replications per point, defaults to 1.
+simulate: optional, if true, the default, points run as discrete-event simulations, otherwise in wall-clock time.
+seed: optional base seed of the replications, defaults to 0.
+
+The goal times of every point are cached on disk under the hash of the point's full configuration, i.e. its scenario definition, runs, seed and runtime.
+Running a sweep again or extending its grid only runs the points not found in the cache. The cache has to be cleared after changing the SFCS code.
+Run python3 sweep.py --help for all options.'''
+
+import argparse
+import concurrent.futures
+import copy
+import csv
+import hashlib
+import itertools
+import json
+import os
+import random
+
+from scenario import load_scenario, run_scenario
+from study_statistics import RunningStatistics
+
+
+# Part of every hashed configuration. Changing it invalidates all cached results
+CACHE_VERSION = 1
+
+
+def set_parameter(scenario, path, value):
+    '''Sets the value at a dot separated path of keys and list indices in a scenario definition. Only the last key may be missing.'''
+    keys = path.split('.')
+    container = scenario
+    for key in keys[:-1]:
+        container = container[int(key)] if isinstance(container, list) else container[key]
+    if isinstance(container, list):
+        container[int(keys[-1])] = value
+    else:
+        container[keys[-1]] = value
+
+
+def grid_points(parameters):
+    '''Returns every combination of parameter values as a list of mappings of parameter paths to values.'''
+    paths = list(parameters)
+    return [dict(zip(paths, values)) for values in itertools.product(*(parameters[path] for path in paths))]
+
+
+def point_configuration(scenario, point, runs, simulated, seed):
+    '''Returns the full configuration of a point, which is everything its results depend on. Point may hold fixed parameters as well.'''
+    point_scenario = copy.deepcopy(scenario)
+    for path, value in point.items():
+        set_parameter(point_scenario, path, value)
+    return {'version': CACHE_VERSION, 'scenario': point_scenario, 'runs': runs, 'simulated': simulated, 'seed': seed}
+
+
+def configuration_hash(configuration):
+    '''Returns the hash of a configuration, which names its cache file.'''
+    return hashlib.sha256(json.dumps(configuration, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def run_point(configuration):
+    '''Runs the replications of a point and returns their goal times. Points may run in separate processes.'''
+    goal_times = []
+    for iteration in range(configuration['runs']):
+        random.seed(configuration['seed'] + iteration)
+        goal_times.append(run_scenario(configuration['scenario'], False, configuration['simulated']))
+    return goal_times
+
+
+class ResultCache:
+    '''Cache class storing the goal times of points as JSON files named by the hash of their configuration.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+
+    def path(self, configuration):
+        '''Used internally to return the path of the cache file of a configuration.'''
+        return os.path.join(self.directory, configuration_hash(configuration) + '.json')
+
+
+    def get(self, configuration):
+        '''Returns the cached goal times of a configuration or None if it was not run yet.'''
+        try:
+            with open(self.path(configuration), encoding='utf-8') as cache_file:
+                return json.load(cache_file)['goal_times']
+        except FileNotFoundError:
+            return None
+
+
+    def put(self, configuration, goal_times):
+        '''Caches the goal times of a configuration. The file is replaced at once, so an interrupted sweep never leaves a partial result.'''
+        path = self.path(configuration)
+        with open(path + '.part', 'w', encoding='utf-8') as cache_file:
+            json.dump({'configuration': configuration, 'goal_times': goal_times}, cache_file)
+        os.replace(path + '.part', path)
+
+
+def run_sweep(sweep, scenario, cache, workers=1):
+    '''Runs all points of a sweep definition on a scenario definition which are not cached yet and returns a list of tuples of each point and its goal times, in grid order.'''
+    points = grid_points(sweep['parameters'])
+    configurations = [point_configuration(scenario, dict(sweep.get('fixed', {}), **point), sweep.get('runs', 1), sweep.get('simulate', True), sweep.get('seed', 0)) for point in points]
+    goal_times = [cache.get(configuration) for configuration in configurations]
+    missing = [index for index, point_goal_times in enumerate(goal_times) if point_goal_times is None]
+    print(len(points) - len(missing), 'of', len(points), 'points cached')
+
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(run_point, configurations[index]): index for index in missing}
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                goal_times[index] = future.result()
+                cache.put(configurations[index], goal_times[index])
+    else:
+        for index in missing:
+            goal_times[index] = run_point(configurations[index])
+            cache.put(configurations[index], goal_times[index])
+    return list(zip(points, goal_times))
+
+
+def main():
+    '''Main method. Runs a sweep and prints the statistics of every point.'''
+    parser = argparse.ArgumentParser(description='Runs a scenario for every point of a parameter grid, caching the results of every point.')
+    parser.add_argument('sweep', help='JSON sweep file, see the documentation of sweep.py')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes running points in parallel')
+    parser.add_argument('--cache', metavar='DIRECTORY', default='sweep_cache', help='directory the results of all points are cached in')
+    parser.add_argument('--output', metavar='FILE', help='file the statistics of all points are written to as CSV')
+    args = parser.parse_args()
+
+    with open(args.sweep, encoding='utf-8') as sweep_file:
+        sweep = json.load(sweep_file)
+    scenario = load_scenario(os.path.join(os.path.dirname(os.path.abspath(args.sweep)), sweep['scenario']))
+    results = run_sweep(sweep, scenario, ResultCache(args.cache), args.workers)
+
+    paths = list(sweep['parameters'])
+    rows = []
+    for point, goal_times in results:
+        statistics = RunningStatistics()
+        for goal_time in goal_times:
+            statistics.add(goal_time)
+        rows.append([json.dumps(point[path]) for path in paths] + [statistics.mean, statistics.standard_deviation(), statistics.confidence_interval_half_width(), statistics.count])
+    header = paths + ['mean', 'sd', 'ci_half_width', 'runs']
+    for row in rows:
+        print(', '.join(name + ': ' + str(value) for name, value in zip(header, row)))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,82 +1,223 @@
 '''The task module defines manufacturing tasks a SFCS can perform.'''
 
+import asyncio
+import copy
 import time
 
+import instrumentation
+
 
 class Task():
     '''General task class. Characterizes a task by defining a time the task requires to be completed and a name.
-    New tasks can be created by inheriting from this class.'''
+    Inputs and outputs are the task's bill of materials. They map resource names to the amounts a task consumes from and adds to the resource storage.
+    Time, name, inputs and outputs are given per unit of a task type and are shared by all tasks of the type. A task of a quantity greater than one performs that many units at once.
+    Inputs acquired is true if the inputs were already removed from the resource storage before the task was scheduled, in which case performing it never waits for resources.
+    Priority and deadline express the urgency of a task. Tasks of a higher priority are more urgent. The deadline is the point in time on the clock of the resource agents the task should be completed by, or None.
+    New tasks can be created by inheriting from this class and declaring these class attributes. Subclasses should declare __slots__ to keep tasks compact. Their slots are sent to remote holons and copied to the chunks of split tasks like the slots declared here.'''
+    __slots__ = ('resource_storage', 'quantity', 'inputs_acquired', 'priority', 'deadline', 'log_id')
     time = 0.0
     name = None
-    resource_storage = None
+    inputs = {}
+    outputs = {}
+
+
+    def __init__(self, resource_storage, quantity=1, priority=0, deadline=None):
+        self.resource_storage = resource_storage
+        self.quantity = quantity
+        self.inputs_acquired = False
+        self.priority = priority
+        self.deadline = deadline
+
+
+    def __getstate__(self):
+        '''Tasks are sent to remote holons without their resource storage, which the receiving holon replaces with its own. The slots of all task classes are sent, including those of subclasses.'''
+        state = {}
+        for task_type in type(self).__mro__:
+            slots = getattr(task_type, '__slots__', ())
+            for slot in (slots,) if isinstance(slots, str) else slots:
+                if slot not in ('resource_storage', '__dict__', '__weakref__') and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+
+    def __setstate__(self, state):
+        self.resource_storage = None
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
+
+    @property
+    def duration(self):
+        '''Time required to perform all units of the task.'''
+        return self.time * self.quantity
+
+
+    def total_inputs(self):
+        '''Returns the inputs of all units of the task.'''
+        if self.quantity == 1:
+            return self.inputs
+        return {resource_name: amount * self.quantity for resource_name, amount in self.inputs.items()}
+
+
+    def total_outputs(self):
+        '''Returns the outputs of all units of the task.'''
+        if self.quantity == 1:
+            return self.outputs
+        return {resource_name: amount * self.quantity for resource_name, amount in self.outputs.items()}
+
+
+    def split(self, num_chunks):
+        '''Splits the task into at most num_chunks copies of the task whose quantities differ by at most one and add up to the task's quantity.
+        Chunks are copies, so they keep the priority, deadline and any state of subclasses without calling their constructor.
+        If the task has an event log id, chunks are logged under that id followed by a slash and the chunk's index.'''
+        num_chunks = max(1, min(num_chunks, self.quantity))
+        if num_chunks == 1:
+            return [self]
+        chunk_quantity, remainder = divmod(self.quantity, num_chunks)
+        chunks = []
+        for chunk_index in range(num_chunks):
+            chunk = copy.copy(self)
+            # Copies are made through __getstate__(), which leaves out the resource storage
+            chunk.resource_storage = self.resource_storage
+            chunk.quantity = chunk_quantity + (1 if chunk_index < remainder else 0)
+            if hasattr(self, 'log_id'):
+                chunk.log_id = self.log_id + '/' + str(chunk_index)
+            chunks.append(chunk)
+        return chunks
+
+
+    def complete(self):
+        '''Used internally to add the outputs to the resource storage once the task was performed.
+        If instrumentation is enabled, the tardiness of a task with a deadline, i.e. the time it was completed after its deadline, is recorded.'''
+        self.resource_storage.push_resources(self.total_outputs())
+        active_instrumentation = instrumentation.active
+        if active_instrumentation and self.deadline is not None:
+            lateness = active_instrumentation.now() - self.deadline
+            active_instrumentation.observe(self.name, 'tardiness', max(0.0, lateness))
+            if lateness > 0:
+                active_instrumentation.count(self.name, 'deadlines_missed')
 
 
     def execute(self):
-        '''Executes the task.'''
-        pass
+        '''Executes the task.
+        All inputs are removed from the resource storage at once, so a task never holds some of its inputs while waiting for the others.'''
+        if self.inputs_acquired:
+            time.sleep(self.duration)
+            self.complete()
+            return
+        active_instrumentation = instrumentation.active
+        if active_instrumentation:
+            wait_start_time = active_instrumentation.now()
+        if self.resource_storage.pop_resources(self.total_inputs()):
+            if active_instrumentation:
+                active_instrumentation.observe(self.name, 'input_wait', active_instrumentation.now() - wait_start_time)
+            time.sleep(self.duration)
+            self.complete()
+
+
+    def simulate(self, simulation, on_finished):
+        '''Counterpart of execute() used in simulation mode.
+        Once all inputs were removed from the resource storage, the outputs are added after the task's time has passed on the simulation's virtual clock and on_finished is called.'''
+        def finish():
+            self.complete()
+            on_finished()
+
+        if self.inputs_acquired:
+            simulation.schedule(self.duration, finish)
+        else:
+            self.resource_storage.request_resources(self.total_inputs(), lambda: simulation.schedule(self.duration, finish))
+
+
+    async def execute_async(self):
+        '''Counterpart of execute() used by the asyncio runtime. Waiting for inputs and for the task's time suspends the coroutine instead of blocking a thread.'''
+        if not self.inputs_acquired:
+            inputs_acquired = asyncio.get_running_loop().create_future()
+            self.resource_storage.request_resources(self.total_inputs(), lambda: inputs_acquired.done() or inputs_acquired.set_result(True))
+            await inputs_acquired
+        await asyncio.sleep(self.duration)
+        self.complete()
 
 
 class AssembleIronGearWheelTask(Task):
     '''Manufacturing task to assemble iron gear wheels'''
-    def __init__(self, resource_storage):
-        self.time = 0.5
-        self.name = 'IGW_Task'
-        self.resource_storage = resource_storage
-
-
-    def execute(self):
-        if self.resource_storage.pop_resource('iron_plate', 2):
-            time.sleep(0.5)
-            self.resource_storage.push_resource('iron_gear_wheel', 1)
+    __slots__ = ()
+    time = 0.5
+    name = 'IGW_Task'
+    inputs = {'iron_plate': 2}
+    outputs = {'iron_gear_wheel': 1}
 
 
 class AssembleCopperCableTask(Task):
     '''Manufacturing task to assemble copper cables'''
-    def __init__(self, resource_storage):
-        self.time = 0.5
-        self.name = 'CC_Task'
-        self.resource_storage = resource_storage
-
-
-    def execute(self):
-        if self.resource_storage.pop_resource('copper_plate', 1):
-            time.sleep(0.5)
-            self.resource_storage.push_resource('copper_cable', 2)
+    __slots__ = ()
+    time = 0.5
+    name = 'CC_Task'
+    inputs = {'copper_plate': 1}
+    outputs = {'copper_cable': 2}
 
 
 class AssembleElectronicCircuitTask(Task):
     '''Manufacturing task to assemble electronic circuits'''
-    def __init__(self, resource_storage):
-        self.time = 0.5
-        self.name = 'EC_Task'
-        self.resource_storage = resource_storage
-
-
-    def execute(self):
-        if self.resource_storage.pop_resource('iron_plate', 1):
-            if self.resource_storage.pop_resource('copper_cable', 3):
-                time.sleep(0.5)
-                self.resource_storage.push_resource('electronic_circuit', 1)
-            else:
-                self.resource_storage.push_resource('iron_plate', 1)
+    __slots__ = ()
+    time = 0.5
+    name = 'EC_Task'
+    inputs = {'iron_plate': 1, 'copper_cable': 3}
+    outputs = {'electronic_circuit': 1}
 
 
 class AssembleAdvancedCircuitTask(Task):
     '''Manufacturing task to assemble advanced circuits'''
-    def __init__(self, resource_storage):
-        self.time = 6.0
-        self.name = 'AC_Task'
-        self.resource_storage = resource_storage
-
-
-    def execute(self):
-        if self.resource_storage.pop_resource('plastic_bar', 2):
-            if self.resource_storage.pop_resource('copper_cable', 4):
-                if self.resource_storage.pop_resource('electronic_circuit', 2):
-                    time.sleep(6.0)
-                    self.resource_storage.push_resource('advanced_circuit', 1)
-                else:
-                    self.resource_storage.push_resource('plastic_bar', 2)
-                    self.resource_storage.push_resource('copper_cable', 4)
-            else:
-                self.resource_storage.push_resource('plastic_bar', 2)
+    __slots__ = ()
+    time = 6.0
+    name = 'AC_Task'
+    inputs = {'plastic_bar': 2, 'copper_cable': 4, 'electronic_circuit': 2}
+    outputs = {'advanced_circuit': 1}
+
+
+# Maps task names to the task classes performing them. This is used to create tasks from scenario definitions.
+TASK_TYPES = {
+    'IGW_Task': AssembleIronGearWheelTask,
+    'CC_Task': AssembleCopperCableTask,
+    'EC_Task': AssembleElectronicCircuitTask,
+    'AC_Task': AssembleAdvancedCircuitTask,
+}
+
+
+class RecipeGraph:
+    '''Recipe graph of a set of task types built from the inputs and outputs the tasks declare. Task types maps task names to task classes.
+    A task depends on every task producing one of its inputs. The depth of a task is the length of the longest chain of tasks it depends on, so tasks of raw materials have depth 0.'''
+
+    def __init__(self, task_types):
+        self.producers = {}
+        for task_name, task_type in task_types.items():
+            for resource_name in task_type.outputs:
+                self.producers.setdefault(resource_name, []).append(task_name)
+        self.dependencies = {}
+        for task_name, task_type in task_types.items():
+            self.dependencies[task_name] = {producer for resource_name in task_type.inputs for producer in self.producers.get(resource_name, [])}
+        self.depths = {}
+        for task_name in task_types:
+            self.depth(task_name)
+
+
+    def depth(self, task_name, visited=()):
+        '''Returns the depth of a task. Unknown tasks have depth 0.'''
+        if task_name in self.depths:
+            return self.depths[task_name]
+        if task_name in visited:
+            raise ValueError('The recipe of task ' + str(task_name) + ' is cyclic')
+        depth = 0
+        for dependency in self.dependencies.get(task_name, ()):
+            depth = max(depth, self.depth(dependency, visited + (task_name,)) + 1)
+        self.depths[task_name] = depth
+        return depth
+
+
+    def order(self, tasks):
+        '''Returns a list of tasks sorted so that producers come before the tasks consuming their outputs. Tasks of the same depth keep their given order.'''
+        return sorted(tasks, key=lambda task: self.depth(task.name))
+
+
+# Recipe graph of all task types
+RECIPE_GRAPH = RecipeGraph(TASK_TYPES)
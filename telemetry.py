@@ -0,0 +1,113 @@
+'''The telemetry module defines a bounded-memory recorder sampling the contents of a resource storage over time.'''
+
+import os
+
+import numpy as np
+
+
+class ResourceRecorder:
+    '''Recorder class sampling the amounts of a list of resources in a resource storage into a preallocated NumPy column store.
+    The store holds capacity samples with one column for the sample times and one column per resource.
+    Without a path the store is a ring buffer which keeps the newest capacity samples.
+    With a path every full store is spilled to disk, so all samples are kept. Closing the recorder writes them to path as a .npy file of shape (samples, 1 + resources).'''
+
+    def __init__(self, resource_storage, resource_names, capacity=100000, path=None):
+        self.resource_storage = resource_storage
+        self.resource_names = list(resource_names)
+        self.columns = {resource_name: index + 1 for index, resource_name in enumerate(self.resource_names)}
+        self.capacity = capacity
+        self.store = np.zeros((capacity, 1 + len(self.resource_names)), order='F')
+        self.num_samples = 0
+        self.path = path
+        self.spill_path = None if path is None else path + '.part'
+        self.num_spilled_samples = 0
+        self.closed = False
+        if self.spill_path:
+            open(self.spill_path, 'wb').close()
+
+
+    def sample(self, sample_time):
+        '''Records the current amounts of all resources at sample_time.'''
+        row = self.num_samples % self.capacity
+        if self.spill_path and self.num_samples > 0 and row == 0:
+            self.spill()
+        _, resources = self.resource_storage.snapshot()
+        for resource_name, column in self.columns.items():
+            self.store[row, column] = resources[resource_name]
+        self.store[row, 0] = sample_time
+        self.num_samples += 1
+
+
+    def spill(self):
+        '''Used internally to append the full store to the spill file.'''
+        with open(self.spill_path, 'ab') as spill_file:
+            self.store.tofile(spill_file)
+        self.num_spilled_samples += self.capacity
+        self.num_samples = 0
+
+
+    def stored_samples(self):
+        '''Used internally to return the samples held in memory in chronological order.'''
+        if self.num_samples <= self.capacity:
+            return self.store[:self.num_samples]
+        row = self.num_samples % self.capacity
+        return np.concatenate((self.store[row:], self.store[:row]))
+
+
+    def data(self):
+        '''Returns all recorded samples as an array of shape (samples, 1 + resources).
+        Samples spilled to disk are read through a memory map instead of being loaded into memory.'''
+        if self.closed and self.path:
+            return np.load(self.path, mmap_mode='r')
+        if self.num_spilled_samples == 0:
+            return self.stored_samples()
+        spilled_samples = np.memmap(self.spill_path, dtype=self.store.dtype, mode='r', shape=(self.num_spilled_samples, self.store.shape[1]))
+        return np.concatenate((spilled_samples, self.stored_samples()))
+
+
+    def times(self):
+        '''Returns the sample times in chronological order.'''
+        return self.data()[:, 0]
+
+
+    def column(self, resource_name):
+        '''Returns the recorded amounts of resource_name in chronological order.'''
+        return self.data()[:, self.columns[resource_name]]
+
+
+    def close(self):
+        '''Finishes recording. If the recorder spills to disk, all samples are written to path as a .npy file.'''
+        if self.closed:
+            return
+        if self.path:
+            stored_samples = self.stored_samples()
+            header = {'descr': np.lib.format.dtype_to_descr(self.store.dtype), 'fortran_order': False, 'shape': (self.num_spilled_samples + len(stored_samples), self.store.shape[1])}
+            with open(self.path, 'wb') as npy_file:
+                np.lib.format.write_array_header_1_0(npy_file, header)
+                with open(self.spill_path, 'rb') as spill_file:
+                    while True:
+                        chunk = spill_file.read(1 << 24)
+                        if not chunk:
+                            break
+                        npy_file.write(chunk)
+                stored_samples.tofile(npy_file)
+            os.remove(self.spill_path)
+        self.closed = True
+
+
+def decimate(times, values, max_points):
+    '''Downsamples a series to at most max_points points by min/max bucketing. The samples are split into buckets and the minimum and maximum of every bucket are kept in chronological order, so peaks survive downsampling.
+    Returns the times and values of the kept samples. Series with at most max_points samples are returned unchanged.'''
+    num_samples = len(times)
+    num_buckets = (max_points - 2) // 2
+    if num_samples <= max_points or num_buckets < 1:
+        return times, values
+    bucket_size = num_samples // num_buckets
+    buckets = np.asarray(values[:num_buckets * bucket_size]).reshape(num_buckets, bucket_size)
+    bucket_starts = np.arange(num_buckets) * bucket_size
+    indices = np.unique(np.concatenate((
+        [0, num_samples - 1],
+        bucket_starts + buckets.argmin(axis=1),
+        bucket_starts + buckets.argmax(axis=1),
+    )))
+    return times[indices], values[indices]
@@ -0,0 +1,227 @@
+'''Tests of the transport module. Scenarios with remote holons run in their own process, so a hanging scenario fails its test after a timeout instead of blocking the test run.'''
+
+import errno
+import json
+import os
+import pickle
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+# pylint: disable=wrong-import-position
+from resource_storage import ResourceStorage
+from scenario import count_assemblers, load_scenario
+from task import AssembleCopperCableTask
+from transport import ACCEPT_RETRY_DELAY, DEFAULT_AUTHKEY, RemoteResourceAgent, RemoteResourceStorage, StorageServer, serve_holon
+
+
+# Seconds a scenario may run before its test fails
+SCENARIO_TIMEOUT = 120
+
+RUN_SCENARIO = 'import sys; from scenario import load_scenario, run_scenario; print("goal time", run_scenario(load_scenario(sys.argv[1]), False))'
+
+
+def free_port():
+    '''Returns a local port that is currently free.'''
+    with socket.socket() as free_socket:
+        free_socket.bind(('localhost', 0))
+        return free_socket.getsockname()[1]
+
+
+def run_scenario_process(scenario):
+    '''Runs a scenario definition in a new process and returns its goal time. The process and all holons it spawned are killed if it takes longer than SCENARIO_TIMEOUT seconds.'''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'scenario.json')
+        with open(path, 'w', encoding='utf-8') as scenario_file:
+            json.dump(scenario, scenario_file)
+        process = subprocess.Popen([sys.executable, '-c', RUN_SCENARIO, path], cwd=REPOSITORY, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, start_new_session=True)
+        try:
+            output, _ = process.communicate(timeout=SCENARIO_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise AssertionError(scenario['name'] + ' did not finish within ' + str(SCENARIO_TIMEOUT) + ' seconds')
+    if process.returncode != 0:
+        raise AssertionError(scenario['name'] + ' failed:\n' + output)
+    return float(output.split('goal time')[-1])
+
+
+class MessageServerTest(unittest.TestCase):
+    '''Tests of the connection handling of message servers.'''
+
+    def test_failed_handshakes_do_not_stop_the_server(self):
+        resource_storage = ResourceStorage()
+        resource_storage.resources = {'copper_plate': 3}
+        server = StorageServer(resource_storage)
+        server.run()
+        try:
+            # A client closing the connection during the handshake, one stalling it and one sending garbage
+            socket.create_connection(server.address).close()
+            stalling_socket = socket.create_connection(server.address)
+            with socket.create_connection(server.address) as garbage_socket:
+                garbage_socket.sendall(b'garbage')
+            self.assertEqual(RemoteResourceStorage(server.address, DEFAULT_AUTHKEY).snapshot()[1], {'copper_plate': 3})
+            stalling_socket.close()
+        finally:
+            server.stop()
+
+
+    def test_concurrent_clients_are_all_served(self):
+        resource_storage = ResourceStorage()
+        resource_storage.resources = {'copper_plate': 3}
+        server = StorageServer(resource_storage)
+        server.run()
+        snapshots = []
+        try:
+            # Every thread of a proxy opens its own connection, so agent and negotiation threads connect at the same time
+            proxy = RemoteResourceStorage(server.address, DEFAULT_AUTHKEY)
+            threads = [threading.Thread(target=lambda: snapshots.append(proxy.snapshot()[1]), daemon=True) for _ in range(64)]
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + SCENARIO_TIMEOUT / 4
+            for thread in threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+        finally:
+            server.stop()
+        self.assertEqual(snapshots, [{'copper_plate': 3}] * 64)
+
+
+    def test_closed_listener_stops_the_server(self):
+        server = StorageServer(ResourceStorage())
+        server.listener.close()
+        serve_thread = threading.Thread(target=server.serve_forever)
+        serve_thread.start()
+        serve_thread.join(SCENARIO_TIMEOUT)
+        self.assertFalse(serve_thread.is_alive())
+
+
+    def test_failed_accepts_are_retried_after_a_delay(self):
+        server = StorageServer(ResourceStorage())
+        listener = server.listener
+        accept_times = []
+
+        def accept():
+            accept_times.append(time.monotonic())
+            if len(accept_times) == 3:
+                server.stopped.set()
+            raise OSError(errno.EMFILE, 'Too many open files')
+
+        # The listener's accept() is replaced, so accepting keeps failing like it does without free file descriptors
+        listener.accept = accept
+        server.serve_forever()
+        self.assertEqual(len(accept_times), 3)
+        self.assertGreaterEqual(accept_times[2] - accept_times[0], 3 * ACCEPT_RETRY_DELAY)
+
+
+    def test_default_key_requires_loopback_address(self):
+        with self.assertRaises(ValueError):
+            StorageServer(ResourceStorage(), ('0.0.0.0', 0))
+
+
+class ColouredCopperCableTask(AssembleCopperCableTask):
+    '''Task of a subclass declaring its own slot and constructor, which is sent to holons and split like built-in tasks.'''
+    __slots__ = ('colour',)
+
+    def __init__(self, resource_storage, colour, quantity=1):
+        AssembleCopperCableTask.__init__(self, resource_storage, quantity)
+        self.colour = colour
+
+
+class TaskTransferTest(unittest.TestCase):
+    '''Tests of sending tasks to remote holons.'''
+
+    def test_slots_of_subclasses_are_sent(self):
+        task = pickle.loads(pickle.dumps(ColouredCopperCableTask(ResourceStorage(), 'red', 3)))
+        self.assertEqual((task.colour, task.quantity, task.resource_storage), ('red', 3, None))
+
+
+    def test_chunks_keep_the_state_of_subclasses(self):
+        resource_storage = ResourceStorage()
+        chunks = ColouredCopperCableTask(resource_storage, 'red', 5).split(2)
+        self.assertEqual([(chunk.colour, chunk.quantity, chunk.resource_storage) for chunk in chunks], [('red', 3, resource_storage), ('red', 2, resource_storage)])
+
+
+class RemoteResourceAgentTest(unittest.TestCase):
+    '''Tests of remote resource agents, which bid and delegate tasks like recursive resource agents.'''
+
+    def test_aggregated_load_and_batched_delegation(self):
+        resource_storage = ResourceStorage()
+        resource_storage.resources = {'copper_plate': 0, 'copper_cable': 0}
+        storage_server = StorageServer(resource_storage)
+        storage_server.run()
+        address_queue = queue.Queue()
+        holon_definition = {'agents': [{'count': 2, 'compatible_tasks': ['CC_Task']}]}
+        holon_thread = threading.Thread(target=serve_holon, args=(holon_definition, storage_server.address, DEFAULT_AUTHKEY, ('localhost', 0), address_queue))
+        holon_thread.start()
+        resource_agent = RemoteResourceAgent(address_queue.get(), ['CC_Task'])
+        try:
+            for _ in range(4):
+                resource_agent.add_task_to_schedule(AssembleCopperCableTask(resource_storage))
+            # The load of the scheduled tasks is shared by the two resource agents of the idle holon
+            self.assertEqual(resource_agent.queue_length(), 2.0)
+            self.assertEqual(resource_agent.estimated_completion_time(), 1.0)
+            # One task is delegated to each resource agent of the holon at once
+            resource_agent.perform_task(resource_agent.task_schedule.get(block=False))
+            self.assertEqual(len(resource_agent.task_schedule), 2)
+        finally:
+            # The holon's resource agents wait for copper plates until resource access is stopped
+            resource_storage.stop_resource_access()
+            resource_agent.stop()
+            holon_thread.join(SCENARIO_TIMEOUT)
+            storage_server.stop()
+        self.assertFalse(holon_thread.is_alive())
+
+
+class RemoteHolonTest(unittest.TestCase):
+    '''Tests running scenarios with remote holons.'''
+
+    def setUp(self):
+        self.scenario = load_scenario(os.path.join(REPOSITORY, 'scenarios', 'remote_holons.json'))
+        # Failing tests do not wait for a goal that cannot be accomplished anymore
+        self.scenario['stop']['max_time'] = SCENARIO_TIMEOUT / 2
+
+
+    def test_spawned_holons(self):
+        self.assertGreater(run_scenario_process(self.scenario), 0.0)
+
+
+    def test_spawned_holons_holding_back_tasks(self):
+        self.scenario['bidding_manager']['agents'][1]['bidding_manager']['hold_back_tasks'] = True
+        self.assertGreater(run_scenario_process(self.scenario), 0.0)
+
+
+    def test_holon_served_at_address(self):
+        holon_definition = {'agents': [{'count': 4, 'compatible_tasks': ['CC_Task', 'EC_Task']}]}
+        storage_address = 'localhost:' + str(free_port())
+        holon_address = 'localhost:' + str(free_port())
+        self.scenario['storage_address'] = storage_address
+        self.scenario['bidding_manager'] = {'agents': [{'compatible_tasks': ['CC_Task', 'EC_Task'], 'address': holon_address}]}
+        self.assertEqual(count_assemblers(self.scenario['bidding_manager']), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'holon.json')
+            with open(path, 'w', encoding='utf-8') as definition_file:
+                json.dump(holon_definition, definition_file)
+            holon = subprocess.Popen([sys.executable, 'transport.py', path, '--storage', storage_address, '--listen', holon_address], cwd=REPOSITORY, stdout=subprocess.PIPE, text=True)
+            try:
+                self.assertIn('Serving holon at', holon.stdout.readline())
+                self.assertGreater(run_scenario_process(self.scenario), 0.0)
+                # The scenario stops the holon once it is finished
+                holon.wait(SCENARIO_TIMEOUT)
+            finally:
+                holon.kill()
+                holon.stdout.close()
+                holon.wait()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,442 @@
+'''The transport module lets holons run in separate processes or on other hosts, so large hierarchies are not limited to the one core a single process can use.
+A holon is a sub bidding manager together with its resource agents. It is served by a holon server and represented in the parent bidding manager by a remote resource agent, which behaves like a recursive resource agent.
+The resource storage stays in the process running the scenario and is served to all holons by a storage server. Remote holons access it through a resource storage proxy.
+Messages are sent over multiprocessing connections, which work over local and TCP sockets and authenticate clients with a shared key.
+Messages are pickles, so anyone knowing the key is able to run arbitrary code in the processes of a scenario. The default key may therefore only be used with loopback addresses.
+Remote holons only support the threaded runtime.
+
+A holon can be started on another host with python3 transport.py DEFINITION --storage HOST:PORT --listen HOST:PORT --authkey KEY, where DEFINITION is a JSON file holding a bidding manager definition as used by scenario files.'''
+
+import argparse
+import errno
+import ipaddress
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import uuid
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from sfcs import ResourceAgent, TaskSchedule
+
+
+logger = logging.getLogger(__name__)
+
+# Number of connections a message server's listener queues until they are accepted. Listeners only queue one by default, so concurrent connects of agent and negotiation threads could be dropped
+LISTEN_BACKLOG = socket.SOMAXCONN
+
+# Seconds a message server waits before accepting again after accepting a connection failed. The delay doubles with every further failure up to MAX_ACCEPT_RETRY_DELAY
+ACCEPT_RETRY_DELAY = 0.01
+MAX_ACCEPT_RETRY_DELAY = 1.0
+
+# Key of holons and scenarios only using loopback addresses if no key is given
+DEFAULT_AUTHKEY = b'sfcs'
+
+# Number of random bytes of the keys of scenarios whose holons are all spawned by the scenario
+RANDOM_AUTHKEY_BYTES = 32
+
+
+def parse_address(address):
+    '''Returns the (host, port) tuple of an address given as a host:port string.'''
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def is_loopback(host):
+    '''Returns true if host is a loopback host name or address, so only processes of the same host are able to connect to it.'''
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def choose_authkey(authkey, addresses, shared):
+    '''Returns the key authenticating the connections of a scenario or holon using addresses, which are (host, port) tuples.
+    A given key is returned encoded. Without a key, the default key is returned if the key is shared with holons started on their own, otherwise a random key.
+    Raises a ValueError if no key is given and any address is not a loopback address.'''
+    if authkey is not None:
+        return authkey.encode() if isinstance(authkey, str) else authkey
+    for host, _ in addresses:
+        if not is_loopback(host):
+            raise ValueError('An explicit authkey is required to use the non-loopback address ' + str(host))
+    return DEFAULT_AUTHKEY if shared else os.urandom(RANDOM_AUTHKEY_BYTES)
+
+
+class MessageServer:
+    '''Base class of servers answering messages of the form (method name, arguments) with the result of handle().
+    Every connection is served by its own thread, so a blocking call only blocks the connection it was made on.
+    Clients are authenticated by the thread serving their connection instead of while accepting it, so a client failing or stalling the handshake cannot stop or block the server.'''
+
+    def __init__(self, address=('localhost', 0), authkey=DEFAULT_AUTHKEY):
+        if authkey == DEFAULT_AUTHKEY and not is_loopback(address[0]):
+            raise ValueError('An explicit authkey is required to serve at the non-loopback address ' + str(address[0]))
+        self.listener = Listener(address, backlog=LISTEN_BACKLOG)
+        self.address = self.listener.address
+        self.authkey = authkey
+        self.stopped = threading.Event()
+
+
+    def handle(self, method, args):
+        '''Handles a message and returns the answer.'''
+        raise NotImplementedError
+
+
+    def serve_forever(self):
+        '''Accepts connections until the server is stopped or its listener is closed.'''
+        retry_delay = ACCEPT_RETRY_DELAY
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except Exception as error:  # pylint: disable=broad-except
+                # A closed listener raises an OSError without errno itself and closed sockets raise EBADF or EINVAL
+                if self.stopped.is_set() or (isinstance(error, OSError) and error.errno in (None, errno.EBADF, errno.EINVAL)):
+                    break
+                # Other errors, like running out of file descriptors, may persist, so accepting is retried after a growing delay instead of in a busy loop
+                logger.warning('Accepting a connection at %s failed, retrying in %s seconds', self.address, retry_delay, exc_info=error)
+                self.stopped.wait(retry_delay)
+                retry_delay = min(2 * retry_delay, MAX_ACCEPT_RETRY_DELAY)
+                continue
+            retry_delay = ACCEPT_RETRY_DELAY
+            threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+        self.listener.close()
+
+
+    def serve_connection(self, connection):
+        '''Used internally to authenticate the client of a connection and answer its messages until the connection is closed.'''
+        with connection:
+            # The same handshake Listener.accept() performs with an authkey
+            try:
+                deliver_challenge(connection, self.authkey)
+                answer_challenge(connection, self.authkey)
+            except Exception:  # pylint: disable=broad-except
+                return
+            while True:
+                try:
+                    method, args = connection.recv()
+                except Exception:  # pylint: disable=broad-except
+                    return
+                try:
+                    answer = self.handle(method, args)
+                except Exception as error:  # pylint: disable=broad-except
+                    # Errors are raised again by the client instead of leaving it waiting for an answer
+                    answer = error
+                try:
+                    connection.send(answer)
+                except Exception:  # pylint: disable=broad-except
+                    # Closing the connection wakes up the client waiting for the answer
+                    return
+
+
+    def run(self):
+        '''Starts serving connections in another thread.'''
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+    def stop(self):
+        '''Stops accepting connections. Connections already accepted are served until they are closed.'''
+        self.stopped.set()
+        # Connecting wakes up serve_forever() waiting for the next connection
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+
+class StorageServer(MessageServer):
+    '''Server giving remote holons access to a resource storage.
+    Resource requests of a proxy are granted by the resource storage in the server's process. The ids of granted requests are queued per proxy until the proxy fetches them.'''
+
+    METHODS = ('pop_resources', 'push_resources', 'resources_available', 'snapshot', 'stop_resource_access')
+
+    def __init__(self, resource_storage, address=('localhost', 0), authkey=DEFAULT_AUTHKEY):
+        MessageServer.__init__(self, address, authkey)
+        self.resource_storage = resource_storage
+        # Maps the ids of proxies to queues of the ids of their granted resource requests
+        self.granted_requests = {}
+        self.granted_requests_lock = threading.Lock()
+
+
+    def get_granted_requests(self, proxy_id):
+        '''Used internally to return the queue of the ids of granted resource requests of a proxy.'''
+        with self.granted_requests_lock:
+            return self.granted_requests.setdefault(proxy_id, queue.SimpleQueue())
+
+
+    def handle(self, method, args):
+        if method == 'request_resources':
+            resources, proxy_id, request_id = args
+            granted_requests = self.get_granted_requests(proxy_id)
+            self.resource_storage.request_resources(resources, lambda: granted_requests.put(request_id))
+            return None
+        if method == 'wait_for_granted_requests':
+            # Blocks the connection of the proxy's thread calling the callbacks of granted requests until a request is granted
+            granted_requests = self.get_granted_requests(args[0])
+            request_ids = [granted_requests.get()]
+            while not granted_requests.empty():
+                request_ids.append(granted_requests.get())
+            return request_ids
+        if method not in self.METHODS:
+            raise ValueError('Unknown resource storage method ' + str(method))
+        return getattr(self.resource_storage, method)(*args)
+
+
+class MessageClient:
+    '''Base class of clients calling the methods of a message server at address. Every thread opens its own connection, so a blocking call only blocks the thread making it.'''
+
+    def __init__(self, address, authkey=DEFAULT_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.connections = threading.local()
+
+
+    def call(self, method, *args):
+        '''Used internally to call a method of the server and return its result. Errors raised by the server are raised again.'''
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            connection = self.connections.connection = Client(self.address, authkey=self.authkey)
+        connection.send((method, args))
+        answer = connection.recv()
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class RemoteResourceStorage(MessageClient):
+    '''Resource storage proxy forwarding all accesses to a storage server.
+    Every thread opens its own connection, so resource agents waiting for resources do not block each other.
+    The callbacks of resource requests are called by a single thread of the proxy, which waits for the storage server to grant them.'''
+
+    def __init__(self, address, authkey=DEFAULT_AUTHKEY):
+        MessageClient.__init__(self, address, authkey)
+        # Identifies the resource requests of this proxy at the storage server
+        self.proxy_id = uuid.uuid4().hex
+        self.request_ids = itertools.count()
+        self.request_callbacks = {}
+        self.request_callbacks_lock = threading.Lock()
+        self.granted_requests_thread = None
+
+
+    def pop_resource(self, resource_name, amount):
+        return self.pop_resources({resource_name: amount})
+
+
+    def pop_resources(self, resources):
+        return self.call('pop_resources', resources)
+
+
+    def request_resources(self, resources, callback):
+        with self.request_callbacks_lock:
+            request_id = next(self.request_ids)
+            self.request_callbacks[request_id] = callback
+            if self.granted_requests_thread is None:
+                self.granted_requests_thread = threading.Thread(target=self.call_granted_callbacks, daemon=True)
+                self.granted_requests_thread.start()
+        self.call('request_resources', resources, self.proxy_id, request_id)
+
+
+    def call_granted_callbacks(self):
+        '''Used internally to wait for the storage server to grant resource requests and call their callbacks, until the connection to the server is closed.'''
+        while True:
+            try:
+                request_ids = self.call('wait_for_granted_requests', self.proxy_id)
+            except (EOFError, OSError):
+                return
+            for request_id in request_ids:
+                with self.request_callbacks_lock:
+                    callback = self.request_callbacks.pop(request_id)
+                callback()
+
+
+    def push_resource(self, resource_name, amount):
+        self.push_resources({resource_name: amount})
+
+
+    def push_resources(self, resources):
+        self.call('push_resources', resources)
+
+
+    def resource_available(self, resource_name, amount):
+        return self.resources_available({resource_name: amount})
+
+
+    def resources_available(self, resources):
+        return self.call('resources_available', resources)
+
+
+    def snapshot(self):
+        return self.call('snapshot')
+
+
+    def stop_resource_access(self):
+        self.call('stop_resource_access')
+
+
+class HolonServer(MessageServer):
+    '''Server running a holon. Tasks sent to it are scheduled by its bidding manager, and a stop message stops all resource agents of the holon and the server itself.
+    The load messages answer the number of resource agents of the holon's bidding manager together with their summed queue lengths or estimated completion times, which remote resource agents bid with.
+    Bidding managers holds all bidding managers of the holon, including the sub bidding managers of recursive resource agents.'''
+
+    def __init__(self, bidding_manager, bidding_managers, resource_storage, address=('localhost', 0), authkey=DEFAULT_AUTHKEY):
+        MessageServer.__init__(self, address, authkey)
+        self.bidding_manager = bidding_manager
+        self.bidding_managers = bidding_managers
+        self.resource_storage = resource_storage
+
+
+    def handle(self, method, args):
+        if method == 'schedule_tasks':
+            tasks = args[0]
+            for task in tasks:
+                task.resource_storage = self.resource_storage
+            return self.bidding_manager.schedule_tasks(tasks)
+        if method == 'queue_length':
+            resource_agents = self.bidding_manager.manufacturing_resources
+            return len(resource_agents), sum(resource_agent.queue_length() for resource_agent in resource_agents)
+        if method == 'estimated_completion_time':
+            task = args[0]
+            resource_agents = self.bidding_manager.manufacturing_resources
+            return len(resource_agents), sum(resource_agent.estimated_completion_time(task) for resource_agent in resource_agents)
+        if method == 'stop':
+            for bidding_manager in self.bidding_managers:
+                for resource_agent in bidding_manager.manufacturing_resources:
+                    resource_agent.stop()
+            self.stop()
+            return True
+        raise ValueError('Unknown holon method ' + str(method))
+
+
+class RemoteResourceAgent(ResourceAgent, MessageClient):
+    '''Resource agent representing a holon served by a holon server at address.
+    Like a recursive resource agent it delegates tasks in batches of up to max_delegated_tasks tasks, which default to the number of resource agents of the holon, and picks up its next task once the delegated ones were awarded.
+    It bids with the load of the holon's resource agents on average, including the tasks it has yet to delegate. The load is asked from the holon server, so every bid of the agent costs a round trip to the holon.
+    If the holon was started by spawn_holon(), its process is joined when the agent is stopped.
+    Deadlines of delegated tasks refer to the clock of the sending process, so they are only meaningful for holons running on the same host.'''
+    dynamic_load = True
+
+    def __init__(self, address, compatible_tasks, authkey=DEFAULT_AUTHKEY, process=None, task_schedule_type=TaskSchedule, max_delegated_tasks=None):
+        ResourceAgent.__init__(self, compatible_tasks, task_schedule_type=task_schedule_type)
+        MessageClient.__init__(self, address, authkey)
+        self.process = process
+        self.max_delegated_tasks = max_delegated_tasks
+        # Number of resource agents of the holon, which is asked from the holon server on the first delegation
+        self.num_holon_agents = None
+
+
+    def holon_load(self, method, *args):
+        '''Used internally to return the number of resource agents of the holon and their summed load as answered to a load message. A stopped holon has no resource agents.'''
+        try:
+            return self.call(method, *args)
+        except (EOFError, OSError):
+            return 0, 0.0
+
+
+    def take_delegated_tasks(self, task):
+        '''Used internally to return task together with further scheduled tasks, up to the number of tasks delegated at once.'''
+        max_delegated_tasks = self.max_delegated_tasks
+        if not max_delegated_tasks:
+            if self.num_holon_agents is None:
+                self.num_holon_agents = self.holon_load('queue_length')[0]
+            max_delegated_tasks = max(1, self.num_holon_agents)
+        return [task] + self.task_schedule.take(max_delegated_tasks - 1)
+
+
+    def perform_task(self, task):
+        '''Delegates a task and further scheduled tasks to the remote bidding manager.'''
+        try:
+            self.call('schedule_tasks', self.take_delegated_tasks(task))
+        except (EOFError, OSError):
+            # The holon was stopped while the tasks were delegated
+            return
+
+
+    def queue_length(self):
+        num_holon_agents, holon_queue_length = self.holon_load('queue_length')
+        if num_holon_agents == 0:
+            return len(self.task_schedule)
+        return (len(self.task_schedule) + holon_queue_length) / num_holon_agents
+
+
+    def estimated_completion_time(self, task=None):
+        if task is None:
+            completion_time = self.task_schedule.total_task_time
+        else:
+            completion_time = self.task_schedule.time_ahead_of(task)
+        num_holon_agents, holon_completion_time = self.holon_load('estimated_completion_time', task)
+        if num_holon_agents == 0:
+            return completion_time if task is None else completion_time + task.duration
+        # The estimates of the holon's resource agents include the time of the task itself
+        return (completion_time + holon_completion_time) / num_holon_agents
+
+
+    def stop(self):
+        '''Stops the resource agent and the holon it represents.'''
+        ResourceAgent.stop(self)
+        try:
+            with Client(self.address, authkey=self.authkey) as connection:
+                connection.send(('stop', ()))
+                connection.recv()
+        except (EOFError, OSError):
+            pass
+        if self.process:
+            self.process.join()
+
+
+def serve_holon(definition, storage_address, authkey=DEFAULT_AUTHKEY, address=('localhost', 0), address_queue=None):
+    '''Builds a holon from a bidding manager definition and serves it until it is stopped. The holon accesses the resource storage served at storage_address.
+    The address the holon is served at is put into address_queue, if given. Remote holons of the holon itself use the same key.'''
+    # Imported here, because the scenario module imports this module
+    from scenario import build_bidding_manager
+
+    resource_storage = RemoteResourceStorage(storage_address, authkey)
+    bidding_managers = []
+    bm = build_bidding_manager(definition, resource_storage, None, bidding_managers, storage_address, authkey)
+    server = HolonServer(bm, bidding_managers, resource_storage, address, authkey)
+    if address_queue:
+        address_queue.put(server.address)
+    server.serve_forever()
+
+
+def spawn_holon(definition, compatible_tasks, storage_address, authkey, task_schedule_type=TaskSchedule, max_delegated_tasks=None):
+    '''Starts a holon built from a bidding manager definition in a new local process and returns a remote resource agent representing it, which delegates up to max_delegated_tasks tasks at once.
+    Authkey is the key of the storage server, which the holon is served with as well. It is passed to the new process through the pipe multiprocessing spawns it with.'''
+    # Processes are spawned instead of forked, because forking a process running agent threads is unsafe
+    context = multiprocessing.get_context('spawn')
+    address_queue = context.Queue()
+    process = context.Process(target=serve_holon, args=(definition, storage_address, authkey, ('localhost', 0), address_queue))
+    process.start()
+    return RemoteResourceAgent(address_queue.get(), compatible_tasks, authkey, process, task_schedule_type, max_delegated_tasks)
+
+
+def main():
+    '''Main method. Serves a holon for a scenario running on another host.'''
+    parser = argparse.ArgumentParser(description='Serves a holon whose resource agents access a remote resource storage.')
+    parser.add_argument('definition', help='JSON file holding the bidding manager definition of the holon')
+    parser.add_argument('--storage', required=True, help='HOST:PORT address of the storage server')
+    parser.add_argument('--listen', default='localhost:0', help='HOST:PORT address the holon is served at')
+    parser.add_argument('--authkey', help='key shared by all processes of the scenario. Required if any address is not a loopback address')
+    args = parser.parse_args()
+    storage_address = parse_address(args.storage)
+    address = parse_address(args.listen)
+    try:
+        authkey = choose_authkey(args.authkey, [storage_address, address], True)
+    except ValueError as error:
+        parser.error(str(error))
+
+    with open(args.definition, encoding='utf-8') as definition_file:
+        definition = json.load(definition_file)
+    address_queue = queue.Queue()
+    serve_thread = threading.Thread(target=serve_holon, args=(definition, storage_address, authkey, address, address_queue))
+    serve_thread.start()
+    host, port = address_queue.get()
+    print('Serving holon at', str(host) + ':' + str(port))
+    serve_thread.join()
+
+
+if __name__ == '__main__':
+    main()